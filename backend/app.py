@@ -1,6 +1,10 @@
 from flask import Flask
 from routes import main_bp
 from database import mongo
+from services.agents import warm_up_agent
+from services.background_jobs import recover_jobs
+from services.embedding_backends import warm_up_embedding_backends
+from services.embedding_service import sweep_spill_files
 from dotenv import load_dotenv
 import os
 from flask_cors import CORS
@@ -14,5 +18,10 @@ mongo.init_app(app)
 
 app.register_blueprint(main_bp)
 
+warm_up_agent()
+warm_up_embedding_backends()
+recover_jobs()
+mongo.add_connect_hook(sweep_spill_files)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0') 
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""ASGI entry point: serves chat natively on the event loop and mounts the Flask app for every other route.
+
+Run with: uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from app import app
+from services.agents import warm_up_agent
+from services.auth_service import authorize_request
+from services.chatbot_service import aget_user_chat_response
+from services.embedding_backends import close_embedding_sessions
+from services.metrics import metrics, start_trace, end_trace, server_timing, METRICS_ENABLED
+from try_catch_decorator_new import CustomException
+
+CHAT_PATH = re.compile(r"^/api/chat/(?P<name>[^/]+)$")
+
+flask_application = WsgiToAsgi(app)
+
+
+class AuthorizationError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+async def read_json_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return json.loads(body or b"{}")
+
+
+async def send_json(send, scope, payload, status_code, extra_headers=()):
+    headers = [(b"content-type", b"application/json"), *extra_headers]
+    origin = dict(scope["headers"]).get(b"origin")
+    if origin:
+        headers += [(b"access-control-allow-origin", origin), (b"access-control-allow-credentials", b"true")]
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+
+async def chat_with_user(scope, receive, send, name):
+    started = time.perf_counter()
+    trace_token = start_trace()
+    try:
+        data = await read_json_body(receive)
+        organization = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("organization", [None])[0]
+        _, error = await asyncio.to_thread(
+            authorize_request, dict(scope["headers"]).get(b"authorization", b"").decode("latin-1"),
+            organization or data.get('organization'))
+        if error:
+            raise AuthorizationError(*error)
+        chat_history = data.get('chat_history', [])
+        if not chat_history:
+            raise CustomException("Chat history is required")
+        if not isinstance(chat_history, list) or not all(isinstance(turn, list) and turn for turn in chat_history):
+            raise CustomException("Chat history must be a list of [question, answer] pairs")
+        payload, status_code = await aget_user_chat_response(
+            name, chat_history, data.get('organization'))
+    except AuthorizationError as e:
+        payload, status_code = {"error": e.message}, e.status
+    except CustomException as e:
+        print(f"Custom Error: {str(e)}", flush=True)
+        payload, status_code = {"success": False, "error": str(e)}, 400
+    except Exception as e:
+        print(f"Interal Error: {str(e)}", flush=True)
+        payload, status_code = {"success": False, "error": "Server error occurred"}, 500
+
+    trace = end_trace(trace_token)
+    extra_headers = []
+    if METRICS_ENABLED:
+        metrics.observe("http_request_seconds", time.perf_counter() - started,
+                        route="/api/chat/<name>", method="POST", status=str(status_code))
+        if trace:
+            extra_headers.append((b"server-timing", server_timing(trace).encode("utf-8")))
+    await send_json(send, scope, payload, status_code, extra_headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            warm_up_agent(use_async=True)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_embedding_sessions()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        match = CHAT_PATH.match(scope["path"])
+        if match:
+            return await chat_with_user(scope, receive, send, match.group("name"))
+
+    return await flask_application(scope, receive, send)
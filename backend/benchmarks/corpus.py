@@ -0,0 +1,51 @@
+"""Seeded synthetic tenant documents and questions."""
+import random
+
+TOPICS = {
+    "real_estate": ["apartments", "villas", "plots", "rentals", "mortgages", "site visits", "amenities", "possession"],
+    "manufacturing": ["machining", "assembly", "quality control", "lead times", "tooling", "certifications", "logistics"],
+    "finance": ["loans", "insurance", "tax filing", "investments", "interest rates", "audits", "retirement plans"],
+    "general": ["services", "pricing", "support", "office hours", "team", "delivery", "refunds"]
+}
+
+FILLER = ("our", "team", "offers", "clients", "with", "reliable", "fast", "transparent", "pricing", "and",
+          "dedicated", "support", "across", "every", "project", "we", "deliver", "quality", "on", "time")
+
+QUESTION_TEMPLATES = (
+    "What do you offer for {topic}?",
+    "How much do {topic} cost?",
+    "Tell me about your {topic}.",
+    "Do you have experience with {topic}?",
+    "Give me the contact information.",
+    "Hi there",
+)
+
+GREETING_TEMPLATES = ("Hi there", "Hello!", "Hey, good morning", "Thanks, that helps")
+
+
+def tenant_text(organization, seed, paragraphs=12, sentences=4):
+    """Returns blank-line separated paragraphs, the shape chunk_text merges and splits on."""
+    rng = random.Random(seed)
+    topics = TOPICS.get(organization, TOPICS["general"])
+    body = []
+    for _ in range(paragraphs):
+        topic = rng.choice(topics)
+        sentences_out = []
+        for _ in range(sentences):
+            words = rng.choices(FILLER, k=rng.randint(8, 16))
+            words.insert(rng.randrange(len(words)), topic)
+            sentences_out.append(" ".join(words).capitalize() + ".")
+        body.append(" ".join(sentences_out))
+    body.append(f"Contact us at +1-555-{seed % 10000:04d} or hello{seed}@example.com.")
+    return "\n\n".join(body)
+
+
+def questions(organization, count, seed=0):
+    rng = random.Random(seed)
+    topics = TOPICS.get(organization, TOPICS["general"])
+    return [rng.choice(QUESTION_TEMPLATES).format(topic=rng.choice(topics)) for _ in range(count)]
+
+
+def greetings(count, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(GREETING_TEMPLATES) for _ in range(count)]
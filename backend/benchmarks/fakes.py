@@ -0,0 +1,116 @@
+"""Deterministic local stand-ins for the Groq chat model, the Jina embeddings API and MongoDB."""
+import asyncio
+import re
+import time
+import zlib
+from typing import Any, Iterator, List, Optional
+import mongomock
+import mongomock.gridfs
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+GREETINGS = ("hi", "hello", "hey", "good morning", "thanks")
+
+
+class FakeJinaEmbeddings(Embeddings):
+    """Feature-hashed bag-of-words vectors, so texts sharing words land close together.
+
+    Each request sleeps `latency` seconds plus `per_text_latency` per input to model the API round-trip.
+    """
+
+    def __init__(self, dimensions=768, latency=0.0, per_text_latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.requests = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimensions, dtype="float32")
+        for token in re.findall(r"\w+", text.lower()):
+            bucket = zlib.crc32(token.encode("utf-8"))
+            vector[bucket % self.dimensions] += 1.0 if bucket & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _delay(self, count):
+        self.requests += 1
+        return self.latency + self.per_text_latency * count
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatGroq(BaseChatModel):
+    """Answers the query-analyzer and RAG prompts in the XML formats the agents parse.
+
+    `latency` is the time to first token and `token_latency` the gap between streamed tokens.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-groq"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        # The prompts' few-shot examples use the same labels; the real input always comes last.
+        queries = re.findall(r"User Query: (.*)", prompt)
+        question = queries[-1].strip() if queries else ""
+        if "<standalone>" in prompt:
+            if question.lower().startswith(GREETINGS):
+                return "<greeting>true</greeting><response>Hello! How can I help you today?</response>"
+            return f"<greeting>false</greeting><standalone>{question}</standalone>"
+        context = prompt.rsplit("Knowledge Chunks: ", 1)
+        snippet = " ".join(context[1].split()[:40]) if len(context) == 2 else "No details available."
+        return f"<response>Here is what I found about {question.rstrip('?')}: {snippet}</response>"
+
+    def _tokens(self, text):
+        return re.findall(r"\S+\s*", text)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        time.sleep(self.latency + self.token_latency * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens(self._reply(messages)):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeMongo:
+    """Hands out one in-process mongomock client per cluster URL, with GridFS support."""
+
+    def __init__(self):
+        mongomock.gridfs.enable_gridfs_integration()
+        self.clients = {}
+
+    def __call__(self, url, **options):
+        if url not in self.clients:
+            self.clients[url] = mongomock.MongoClient()
+        return self.clients[url]
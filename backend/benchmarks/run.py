@@ -0,0 +1,234 @@
+"""Offline throughput and latency benchmarks for the retrieval and chat pipeline.
+
+Groq, Jina and MongoDB are replaced by the deterministic stand-ins in benchmarks/fakes.py,
+so no keys or clusters are needed. Run from the backend directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.run --tenants 20 --requests 500 --concurrency 16 --llm-latency-ms 300
+
+Reports p50/p95/p99 latency and requests per second for each scenario.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ("create_user", "retrieval", "chat", "chat_greeting", "chat_async", "chat_stream", "stats")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--organizations', nargs='+', default=['real_estate', 'manufacturing', 'finance', 'general'])
+    parser.add_argument('--tenants', type=int, default=10, help='Tenants created per organization')
+    parser.add_argument('--paragraphs', type=int, default=12, help='Paragraphs per tenant document')
+    parser.add_argument('--requests', type=int, default=200, help='Operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--llm-token-latency-ms', type=float, default=0.0)
+    parser.add_argument('--embed-latency-ms', type=float, default=0.0)
+    parser.add_argument('--embed-per-text-latency-ms', type=float, default=0.0)
+    parser.add_argument('--dimensions', type=int, default=768)
+    parser.add_argument('--disable-caches', action='store_true',
+                        help='Turn off the index, retrieval and response caches')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help="Keep the services' own stdout logging")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Must run before any project module is imported, since they read configuration at import time."""
+    for org_name in ('MANUFACTURING', 'FINANCE', 'REAL_ESTATE', 'GENERAL'):
+        os.environ[f'{org_name}_DB_URL'] = f'mongodb://benchmark.local:27017/{org_name.lower()}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('JINA_API_KEY', 'benchmark')
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    os.environ['JOB_WORKERS'] = '1'
+    os.environ['EMBEDDING_BACKEND'] = 'benchmark'
+    if args.disable_caches:
+        os.environ['INDEX_CACHE_MAX_MB'] = '0'
+        os.environ['RETRIEVAL_CACHE_SIZE'] = '0'
+        os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+
+
+def install_fakes(args):
+    from benchmarks.fakes import FakeChatGroq, FakeJinaEmbeddings, FakeMongo
+    import database
+    import services.agent_helper as agent_helper
+    from services.embedding_backends import EmbeddingBackend, register_embedding_backend
+
+    database.MongoClient = FakeMongo()
+    embeddings = FakeJinaEmbeddings(args.dimensions, args.embed_latency_ms / 1000,
+                                    args.embed_per_text_latency_ms / 1000)
+    register_embedding_backend('benchmark', lambda model=None: EmbeddingBackend(
+        'benchmark', embeddings, f"feature-hash-{args.dimensions}"))
+    agent_helper._llm_model = FakeChatGroq(latency=args.llm_latency_ms / 1000,
+                                           token_latency=args.llm_token_latency_ms / 1000)
+    return embeddings
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(name, latencies, errors, wall_seconds):
+    latencies = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0
+    }
+
+
+def measure(name, operation, jobs, concurrency):
+    """Runs operation(*job) for every job on a thread pool and summarizes per-call latency."""
+    def timed(job):
+        started = time.perf_counter()
+        operation(*job)
+        return time.perf_counter() - started
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(timed, job) for job in jobs]:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    return summarize(name, latencies, errors, time.perf_counter() - started)
+
+
+def measure_async(name, operation, jobs, concurrency):
+    """Runs `await operation(*job)` for every job on one event loop, at most `concurrency` at a time."""
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def timed(job):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await operation(*job)
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(job) for job in jobs))
+        return summarize(name, latencies, errors, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def tenant_names(args):
+    prefixes = {'real_estate': 'rs_', 'manufacturing': 'mf_', 'finance': 'fn_', 'general': 'gn_'}
+    return [(f"{prefixes[org]}bench{i}", org) for org in args.organizations for i in range(args.tenants)]
+
+
+def chat_jobs(args, tenants):
+    from benchmarks.corpus import questions
+    rng = random.Random(args.seed)
+    jobs = []
+    for i in range(args.requests):
+        name, org = rng.choice(tenants)
+        question = questions(org, 1, seed=args.seed * 100003 + i)[0]
+        jobs.append((name, question, org))
+    return jobs
+
+
+def greeting_jobs(args, tenants):
+    from benchmarks.corpus import greetings
+    rng = random.Random(args.seed)
+    return [(name, greeting, org) for (name, org), greeting in
+            zip((rng.choice(tenants) for _ in range(args.requests)), greetings(args.requests, args.seed))]
+
+
+def run_scenarios(args):
+    from benchmarks.corpus import tenant_text
+    from services.user_service import create_user
+    from services.embedding_service import (save_user_embeddings, get_relevant_chunks,
+                                            get_all_organizations_embedding_stats)
+    from services.chatbot_service import (get_user_chat_response, aget_user_chat_response,
+                                          stream_user_chat_response)
+
+    tenants = tenant_names(args)
+    results = []
+
+    def create_tenant(name, org, seed):
+        create_user(name, 'benchmark', 'seed', org)
+        save_user_embeddings(name, tenant_text(org, seed, args.paragraphs), org)
+
+    # Tenants are always created; the create_user scenario only decides whether that is reported.
+    create_jobs = [(name, org, args.seed * 1000 + i) for i, (name, org) in enumerate(tenants)]
+    created = measure("create_user", create_tenant, create_jobs, args.concurrency)
+    if "create_user" in args.scenarios:
+        results.append(created)
+
+    jobs = chat_jobs(args, tenants)
+    if "retrieval" in args.scenarios:
+        results.append(measure("retrieval", lambda name, question, org: get_relevant_chunks(name, question, org),
+                               jobs, args.concurrency))
+    if "chat" in args.scenarios:
+        results.append(measure("chat", lambda name, question, org: get_user_chat_response(
+            name, [[question, ""]], org), jobs, args.concurrency))
+    if "chat_greeting" in args.scenarios:
+        results.append(measure("chat_greeting", lambda name, greeting, org: get_user_chat_response(
+            name, [[greeting, ""]], org), greeting_jobs(args, tenants), args.concurrency))
+    if "chat_async" in args.scenarios:
+        results.append(measure_async("chat_async", lambda name, question, org: aget_user_chat_response(
+            name, [[question, ""]], org), jobs, args.concurrency))
+    if "chat_stream" in args.scenarios:
+        results.append(measure("chat_stream", lambda name, question, org: list(stream_user_chat_response(
+            name, [[question, ""]], org)), jobs, args.concurrency))
+    if "stats" in args.scenarios:
+        results.append(measure("stats", get_all_organizations_embedding_stats,
+                               [()] * args.requests, args.concurrency))
+    return results
+
+
+def print_results(results, embeddings):
+    columns = ("scenario", "requests", "errors", "rps", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+    print(f"embedding requests: {embeddings.requests}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    embeddings = install_fakes(args)
+
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            results = run_scenarios(args)
+
+    print_results(results, embeddings)
+    if args.json_path:
+        with open(args.json_path, 'w') as output:
+            json.dump({"arguments": vars(args), "results": results}, output, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
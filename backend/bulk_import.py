@@ -0,0 +1,44 @@
+"""Bulk tenant import from a JSONL or CSV file of (name, password, organization, text) rows.
+
+Usage: python bulk_import.py tenants.jsonl [--format csv] [--no-static-answers] [--batch-size N]
+Writes one JSON result per row to stdout.
+"""
+import argparse
+import json
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from flask import Flask
+from database import mongo
+from services.bulk_import import parse_import_rows, bulk_import_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import tenants in bulk")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["jsonl", "csv"])
+    parser.add_argument("--no-static-answers", action="store_true")
+    parser.add_argument("--batch-size", type=int)
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    app = Flask(__name__)
+    mongo.init_app(app)
+
+    created = failed = 0
+    with app.app_context(), open(args.path, encoding="utf-8", newline="") as stream:
+        rows = parse_import_rows(stream, file_format)
+        for result in bulk_import_users(rows, not args.no_static_answers, args.batch_size):
+            print(json.dumps(result), flush=True)
+            if result["status"] == "created":
+                created += 1
+            else:
+                failed += 1
+
+    print(f"created {created}, failed {failed}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,48 @@
 import os
 
+
+def _mongo_options(prefix):
+    """Connection pool settings for one org, falling back to the global MONGO_* defaults."""
+    def setting(name, default):
+        return int(os.getenv(f'{prefix}_MONGO_{name}', os.getenv(f'MONGO_{name}', default)))
+
+    return {
+        'maxPoolSize': setting('MAX_POOL_SIZE', '100'),
+        'minPoolSize': setting('MIN_POOL_SIZE', '0'),
+        'maxIdleTimeMS': setting('MAX_IDLE_TIME_MS', '60000'),
+        'connectTimeoutMS': setting('CONNECT_TIMEOUT_MS', '20000'),
+        'serverSelectionTimeoutMS': setting('SERVER_SELECTION_TIMEOUT_MS', '30000')
+    }
+
+
+def _embedding_options(prefix):
+    """Embedding backend ('jina' or 'local') and optional model override for one org."""
+    return {
+        'backend': os.getenv(f'{prefix}_EMBEDDING_BACKEND', os.getenv('EMBEDDING_BACKEND', 'jina')),
+        'model': os.getenv(f'{prefix}_EMBEDDING_MODEL')
+    }
+
+
+def _prompt_budget_options(prefix):
+    """Approximate token budgets for each section of one org's chat prompts."""
+    def setting(name, default):
+        return int(os.getenv(f'{prefix}_PROMPT_{name}', os.getenv(f'PROMPT_{name}', default)))
+
+    return {
+        'history_tokens': setting('HISTORY_TOKENS', '1500'),
+        'context_tokens': setting('CONTEXT_TOKENS', '3000'),
+        'question_tokens': setting('QUESTION_TOKENS', '500'),
+        'max_turns': setting('MAX_TURNS', '50')
+    }
+
+
 ORGANIZATIONS = {
     'manufacturing': {
         'db_url': os.getenv('MANUFACTURING_DB_URL'),
+        'mongo_options': _mongo_options('MANUFACTURING'),
+        'embedding': _embedding_options('MANUFACTURING'),
+        'prompt_budget': _prompt_budget_options('MANUFACTURING'),
+        'shared_index': os.getenv('MANUFACTURING_SHARED_INDEX', 'false').lower() == 'true',
         'prompt_type': 'manufacturing',
         'prompt_files': {
             'rag': 'manufacturing-rag-prompt.md'
@@ -10,6 +50,10 @@ ORGANIZATIONS = {
     },
     'finance': {
         'db_url': os.getenv('FINANCE_DB_URL'),
+        'mongo_options': _mongo_options('FINANCE'),
+        'embedding': _embedding_options('FINANCE'),
+        'prompt_budget': _prompt_budget_options('FINANCE'),
+        'shared_index': os.getenv('FINANCE_SHARED_INDEX', 'false').lower() == 'true',
         'prompt_type': 'finance',
         'prompt_files': {
             'rag': 'finance-rag-prompt.md'
@@ -17,6 +61,10 @@ ORGANIZATIONS = {
     },
     'real_estate': {
         'db_url': os.getenv('REAL_ESTATE_DB_URL'),
+        'mongo_options': _mongo_options('REAL_ESTATE'),
+        'embedding': _embedding_options('REAL_ESTATE'),
+        'prompt_budget': _prompt_budget_options('REAL_ESTATE'),
+        'shared_index': os.getenv('REAL_ESTATE_SHARED_INDEX', 'false').lower() == 'true',
         'prompt_type': 'real_estate',
         'prompt_files': {
             'rag': 'real-estate-rag-prompt.md'
@@ -24,6 +72,10 @@ ORGANIZATIONS = {
     },
     'general': {
         'db_url': os.getenv('GENERAL_DB_URL'),
+        'mongo_options': _mongo_options('GENERAL'),
+        'embedding': _embedding_options('GENERAL'),
+        'prompt_budget': _prompt_budget_options('GENERAL'),
+        'shared_index': os.getenv('GENERAL_SHARED_INDEX', 'false').lower() == 'true',
         'prompt_type': 'general',
         'prompt_files': {
             'rag': 'general-org-prompt.md'
@@ -1,32 +1,258 @@
-from flask_pymongo import PyMongo
-from pymongo.errors import ConnectionFailure, OperationFailure
+import os
+import threading
+import time
+from urllib.parse import urlsplit, unquote
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
 from config.organizations import get_org_config, ORGANIZATIONS, DEFAULT_ORG
 from try_catch_decorator_new import handle_exceptions
 
+MONGO_ENSURE_INDEXES = os.getenv('MONGO_ENSURE_INDEXES', 'true').lower() == 'true'
+# Shared-index change log entries expire after this long; a worker that falls further behind reloads fully.
+INDEX_CHANGES_RETENTION_SECONDS = int(os.getenv('INDEX_CHANGES_RETENTION_SECONDS', '86400'))
+
+EMBEDDINGS_FILE_KIND = "embeddings"
+UNTAGGED_EMBEDDINGS_FILES = {"filename": {"$regex": "_embeddings$"}, "metadata.kind": {"$exists": False}}
+# Matches embedding files written before they were tagged, for databases ensure_indexes has not touched.
+EMBEDDINGS_FILES_QUERY = {"$or": [{"metadata.kind": EMBEDDINGS_FILE_KIND}, UNTAGGED_EMBEDDINGS_FILES]}
+
+REQUIRED_INDEXES = {
+    "users": [
+        ([("name", ASCENDING)], {"unique": True}),
+        ([("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+    ],
+    "fs.files": [
+        ([("filename", ASCENDING), ("uploadDate", ASCENDING)], {}),
+        ([("metadata.kind", ASCENDING)], {}),
+    ],
+    "fs.chunks": [
+        ([("files_id", ASCENDING), ("n", ASCENDING)], {"unique": True}),
+    ],
+    "chunk_vectors": [
+        ([("username", ASCENDING), ("position", ASCENDING)], {}),
+    ],
+    "index_changes": [
+        ([("revision", ASCENDING)], {}),
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": INDEX_CHANGES_RETENTION_SECONDS}),
+    ],
+    "jobs": [
+        ([("status", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("created_at", DESCENDING)], {}),
+    ],
+}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for one MongoClient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+
+    def _add(self, field, delta=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add("open")
+        self._add("created")
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+        self._add("closed")
+
+    def connection_checked_out(self, event):
+        self._add("checked_out")
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "created": self.created,
+                "closed": self.closed,
+                "checkout_failures": self.checkout_failures
+            }
+
 
 class MultiOrgMongo:
+    """Per-organization databases, connected lazily on first use.
+
+    Orgs whose URLs point at the same cluster with the same pool settings share one MongoClient;
+    each org's indexes are checked, and connect hooks run, the first time this process touches it.
+    That work happens outside the lock, so a slow or unreachable cluster only delays its own org.
+    """
+
     def __init__(self):
-        self.connections = {}
-        self.default_connection = None
+        self.clients = {}
+        self.databases = {}
+        self.client_keys = {}
+        self.connect_hooks = []
+        self._lock = threading.RLock()
 
     @handle_exceptions
     def init_app(self, app):
         for org_name, config in ORGANIZATIONS.items():
             if not config['db_url']:
-                raise ValueError(f"Database URL not found for organization: {org_name}")
-            
-            mongo_instance = PyMongo()
-            app.config[f'MONGO_URI_{org_name}'] = config['db_url']
-            mongo_instance.init_app(app, uri=config['db_url'])
-            self.connections[org_name] = mongo_instance
-
-        self.default_connection = self.connections[DEFAULT_ORG]
+                print(f"Database URL not found for organization: {org_name}", flush=True)
         return self
 
+    @handle_exceptions
+    def add_connect_hook(self, hook):
+        """Runs hook(org_name) after each org's first connection, and now for orgs already connected."""
+        with self._lock:
+            self.connect_hooks.append(hook)
+            connected = list(self.databases.keys())
+        for org_name in connected:
+            self._run_hook(hook, org_name)
+
+    def _run_hook(self, hook, org_name):
+        try:
+            hook(org_name)
+        except Exception as e:
+            print(f"Connect hook {getattr(hook, '__qualname__', hook)} failed for {org_name}: {str(e)}", flush=True)
+
     @handle_exceptions
     def get_db(self, org_name=None):
-        org_config = get_org_config(org_name)
-        return self.connections.get(org_name, self.default_connection).db
+        org_key = org_name if org_name in ORGANIZATIONS else DEFAULT_ORG
+        db = self.databases.get(org_key)
+        if db is None:
+            db = self._connect(org_key)
+        return db
+
+    def _connect(self, org_name):
+        with self._lock:
+            if org_name in self.databases:
+                return self.databases[org_name]
+
+            config = get_org_config(org_name)
+            if not config['db_url']:
+                raise ValueError(f"Database URL not found for organization: {org_name}")
+            url = urlsplit(config['db_url'])
+            db_name = unquote(url.path.lstrip('/'))
+            if not db_name:
+                raise ValueError(f"Database name missing from URL for organization: {org_name}")
+
+            options = config.get('mongo_options', {})
+            client_key = (url.scheme, url.netloc, url.query, tuple(sorted(options.items())))
+            if client_key not in self.clients:
+                pool_stats = PoolStats()
+                client = MongoClient(config['db_url'], event_listeners=[pool_stats], **options)
+                self.clients[client_key] = (client, pool_stats)
+            client, _ = self.clients[client_key]
+
+            self.databases[org_name] = client[db_name]
+            self.client_keys[org_name] = client_key
+            hooks = list(self.connect_hooks)
 
+        if MONGO_ENSURE_INDEXES:
+            self.ensure_indexes(org_name)
+        self.print_index_report(org_name)
+        for hook in hooks:
+            self._run_hook(hook, org_name)
+        return self.databases[org_name]
+
+    @handle_exceptions
+    def health(self):
+        """Pings each org this process has connected to and reports its pool counters."""
+        report = {}
+        for org_name in ORGANIZATIONS.keys():
+            client_key = self.client_keys.get(org_name)
+            if client_key is None:
+                report[org_name] = {"connected": False}
+                continue
+            client, pool_stats = self.clients[client_key]
+            started = time.perf_counter()
+            try:
+                client.admin.command("ping")
+                status = {"ok": True, "ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+            except PyMongoError as e:
+                status = {"ok": False, "error": str(e)}
+            report[org_name] = {
+                "connected": True,
+                "shared_client": sum(key == client_key for key in self.client_keys.values()) > 1,
+                **status,
+                "pool": pool_stats.snapshot()
+            }
+        return report
+
+    @handle_exceptions
+    def missing_indexes(self, org_name=None):
+        """Returns (collection, keys) for every entry of REQUIRED_INDEXES the org's database lacks."""
+        db = self.get_db(org_name)
+        missing = []
+        for collection, indexes in REQUIRED_INDEXES.items():
+            existing = {tuple(map(tuple, info["key"])) for info in db[collection].index_information().values()}
+            for keys, _ in indexes:
+                if tuple(keys) not in existing:
+                    missing.append((collection, keys))
+        return missing
+
+    @handle_exceptions
+    def ensure_indexes(self, org_name=None):
+        """Creates missing indexes and tags untagged embedding files so they can be found by `metadata.kind`.
+
+        Failures (e.g. duplicate user names blocking the unique index) are reported, not raised,
+        so one bad tenant database never blocks its first request.
+        """
+        try:
+            db = self.get_db(org_name)
+            missing = self.missing_indexes(org_name)
+        except PyMongoError as e:
+            print(f"Index check skipped for {org_name}: {str(e)}", flush=True)
+            return []
+
+        created = []
+        for collection, keys in missing:
+            options = next(opts for spec, opts in REQUIRED_INDEXES[collection] if spec == keys)
+            try:
+                created.append(db[collection].create_index(keys, **options))
+            except (OperationFailure, ConnectionFailure) as e:
+                print(f"Could not create index {keys} on {org_name}.{collection}: {str(e)}", flush=True)
+
+        # Runs on every connect: files written by older workers after the index existed are untagged too.
+        try:
+            db.fs.files.update_many(UNTAGGED_EMBEDDINGS_FILES, {"$set": {"metadata.kind": EMBEDDINGS_FILE_KIND}})
+        except PyMongoError as e:
+            print(f"Could not tag embedding files on {org_name}: {str(e)}", flush=True)
+        return created
+
+    @handle_exceptions
+    def print_index_report(self, org_name=None):
+        try:
+            missing = self.missing_indexes(org_name)
+        except PyMongoError as e:
+            print(f"Index report unavailable for {org_name}: {str(e)}", flush=True)
+            return
+        for collection, keys in missing:
+            print(f"Missing index on {org_name}.{collection}: {keys}", flush=True)
 
 mongo = MultiOrgMongo()
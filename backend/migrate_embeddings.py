@@ -0,0 +1,68 @@
+"""One-shot conversion of legacy pickled `{username}_embeddings` GridFS files to the versioned index format.
+
+For orgs with <ORG>_SHARED_INDEX enabled, the converted per-user indexes are then moved into
+the shared index.
+
+Usage: python migrate_embeddings.py [organization ...]
+"""
+import pickle
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from gridfs import GridFS
+from flask import Flask
+from database import mongo, EMBEDDINGS_FILE_KIND, EMBEDDINGS_FILES_QUERY
+from config.organizations import ORGANIZATIONS
+from services.embedding_service import EMBEDDING_MODEL, invalidate_organization_indexes, backfill_shared_index
+from services.embedding_stats import reconcile_embedding_stats
+from services.index_format import serialize_user_index, is_index_blob
+from services.org_index import shared_index_enabled
+
+
+def convert_legacy_store(data):
+    """Unpickles a LangChain FAISS store (trusted, our own data) and re-encodes it without the docstore pickle."""
+    store = pickle.loads(data)
+    vectors = store.index.reconstruct_n(0, store.index.ntotal)
+    chunks = [
+        store.docstore.search(store.index_to_docstore_id[i]).page_content
+        for i in range(store.index.ntotal)
+    ]
+    return serialize_user_index(vectors, chunks, EMBEDDING_MODEL)
+
+
+def migrate_organization(org_name):
+    fs = GridFS(mongo.get_db(org_name))
+    converted = 0
+    skipped = 0
+    for grid_file in list(fs.find(EMBEDDINGS_FILES_QUERY)):
+        data = grid_file.read()
+        if is_index_blob(data):
+            skipped += 1
+            continue
+        fs.put(convert_legacy_store(data), filename=grid_file.filename,
+               metadata={"kind": EMBEDDINGS_FILE_KIND, "username": grid_file.filename[:-len("_embeddings")]})
+        fs.delete(grid_file._id)
+        converted += 1
+    invalidate_organization_indexes(org_name)
+    reconcile_embedding_stats(org_name)
+    return converted, skipped
+
+
+def backfill_organization(org_name):
+    moved, skipped = backfill_shared_index(org_name)
+    reconcile_embedding_stats(org_name)
+    return moved, skipped
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    mongo.init_app(app)
+    with app.app_context():
+        for org_name in sys.argv[1:] or ORGANIZATIONS.keys():
+            converted, skipped = migrate_organization(org_name)
+            print(f"{org_name}: converted {converted}, already migrated {skipped}", flush=True)
+            if shared_index_enabled(org_name):
+                moved, skipped = backfill_organization(org_name)
+                print(f"{org_name}: moved {moved} users into the shared index, skipped {skipped}", flush=True)
@@ -0,0 +1,22 @@
+"""Rebuilds each organization's precomputed embedding stats document from the stored embeddings.
+
+Usage: python reconcile_embedding_stats.py [organization ...]
+"""
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from flask import Flask
+from database import mongo
+from config.organizations import ORGANIZATIONS
+from services.embedding_stats import reconcile_embedding_stats
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    mongo.init_app(app)
+    with app.app_context():
+        for org_name in sys.argv[1:] or ORGANIZATIONS.keys():
+            stats = reconcile_embedding_stats(org_name)
+            print(f"{org_name}: {stats['count']} embeddings, {stats['size_bytes']} bytes", flush=True)
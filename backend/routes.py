@@ -1,12 +1,19 @@
-from flask import Blueprint, jsonify, request
+import io
+import json
+import time
+from flask import Blueprint, jsonify, request, Response, stream_with_context, g
 from flask_cors import CORS
 from database import mongo
-from services.auth_service import authenticate_user, verify_token, admin_required
+from services.auth_service import authenticate_user, authorize_request, get_auth_cache_stats
 from services.user_service import create_user, delete_user_by_name, get_all_users, get_user_names, delete_all_users
-from services.embedding_service import save_user_embeddings, modify_user_embeddings, get_all_organizations_embedding_stats
-from services.chatbot_service import get_user_chat_response
+from services.embedding_service import get_all_organizations_embedding_stats, get_index_cache_stats
+from services.chatbot_service import get_user_chat_response, stream_user_chat_response
 from functools import wraps
-from services.save_static_question import question_answering_on_static_question, get_question_answer_on_static_question
+from services.save_static_question import get_question_answer_on_static_question
+from services.background_jobs import enqueue_create_user_job, enqueue_modify_user_job, enqueue_static_answers_job
+from services.job_queue import get_job, list_jobs
+from services.bulk_import import parse_import_rows, bulk_import_users
+from services.metrics import metrics, start_trace, end_trace, server_timing, METRICS_ENABLED
 from try_catch_decorator_new import handle_route_exceptions, CustomException
 from config.organizations import ORGANIZATIONS
 
@@ -22,17 +29,24 @@ def ping():
     }), 200
 
 
-def token_required(f):
+def token_required(f=None, admin=False, read_body=True):
+    """Resolves the caller from the bearer token (cached in auth_service) and passes it as the first argument.
+
+    Admin routes always require an admin token; on other routes, requests without a token pass
+    through as anonymous (None) unless AUTH_REQUIRED is set. Streaming routes pass read_body=False
+    so the organization is taken from the query string only and the upload stream is left unread.
+    """
+    if f is None:
+        return lambda func: token_required(func, admin, read_body)
+
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'error': 'Token is missing'}), 401
-
-        token = token.split(' ')[1]
-        organization = request.args.get(
-            'organization') or request.get_json().get('organization')
-        user, error = verify_token(token, organization)
+        organization = None
+        if request.headers.get('Authorization'):
+            organization = request.args.get('organization')
+            if not organization and read_body:
+                organization = (request.get_json(silent=True) or {}).get('organization')
+        user, error = authorize_request(request.headers.get('Authorization'), organization, admin)
         if error:
             return jsonify({'error': error[0]}), error[1]
 
@@ -40,6 +54,40 @@ def token_required(f):
     return decorated
 
 
+@main_bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.trace_token = start_trace()
+
+
+@main_bp.after_app_request
+def record_request_metrics(response):
+    """Records the request duration and returns the stage timings as a Server-Timing header."""
+    if 'trace_token' not in g:
+        return response
+    trace = end_trace(g.pop('trace_token'))
+    if METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe("http_request_seconds", time.perf_counter() - g.request_started,
+                        route=route, method=request.method, status=str(response.status_code))
+        if trace:
+            response.headers['Server-Timing'] = server_timing(trace)
+    return response
+
+
+@main_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@main_bp.route('/api/health', methods=['GET'])
+@handle_route_exceptions
+def health():
+    databases = mongo.health()
+    healthy = all(org.get("ok", True) for org in databases.values())
+    return jsonify({"status": "ok" if healthy else "degraded", "databases": databases}), 200 if healthy else 503
+
+
 @main_bp.route('/api/login', methods=['POST'])
 @handle_route_exceptions
 def login():
@@ -53,7 +101,8 @@ def login():
 
 @main_bp.route('/api/admin/create-user', methods=['POST'])
 @handle_route_exceptions
-def create_new_user():
+@token_required(admin=True)
+def create_new_user(current_user):
     data = request.get_json()
     name = data.get('name')
     password = data.get('password')
@@ -64,14 +113,39 @@ def create_new_user():
     if isinstance(name, tuple) and isinstance(name[0], dict):
         return jsonify(name[0]), name[1]
 
-    response, status_code = save_user_embeddings(name, text, organization)
-    question_answering_on_static_question(name, organization)
-    return jsonify(response), status_code
+    job_id = enqueue_create_user_job(name, text, organization)
+    return jsonify({
+        "message": "User created; embeddings are being generated",
+        "job_id": job_id
+    }), 202
+
+
+@main_bp.route('/api/admin/bulk-import', methods=['POST'])
+@handle_route_exceptions
+@token_required(admin=True, read_body=False)
+def bulk_import(current_user):
+    file_format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+    if file_format not in ('jsonl', 'csv'):
+        raise CustomException("Format must be jsonl or csv")
+    static_answers = request.args.get('static_answers', 'true').lower() == 'true'
+
+    def generate():
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        try:
+            rows = parse_import_rows(stream, file_format)
+            for result in bulk_import_users(rows, static_answers):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"Bulk import error: {str(e)}", flush=True)
+            yield json.dumps({"status": "error", "error": "Server error occurred"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 @main_bp.route('/api/admin/delete-user/<name>', methods=['DELETE'])
 @handle_route_exceptions
-def delete_user(name):
+@token_required(admin=True)
+def delete_user(current_user, name):
     organization = request.args.get('organization')
     response, status_code = delete_user_by_name(name, organization)
     return jsonify(response), status_code
@@ -79,7 +153,8 @@ def delete_user(name):
 
 @main_bp.route('/api/admin/modify-user-embeddings/<name>', methods=['PUT'])
 @handle_route_exceptions
-def modify_user_embeddings_route(name):
+@token_required(admin=True)
+def modify_user_embeddings_route(current_user, name):
     data = request.get_json()
     
     org_map = {
@@ -94,61 +169,181 @@ def modify_user_embeddings_route(name):
     if not determined_org:
         raise CustomException("Invalid username format")
     
-    if not mongo.get_db(determined_org).users.find_one({"name": name}):
+    if not mongo.get_db(determined_org).users.find_one({"name": name}, {"_id": 1}):
         raise CustomException("User not found")
         
-    response, status_code = modify_user_embeddings(
-        name, data.get('text'), determined_org)
-    return jsonify(response), status_code
+    if not data.get('text'):
+        raise CustomException("New text is required")
+
+    job_id = enqueue_modify_user_job(name, data.get('text'), determined_org)
+    return jsonify({
+        "message": "Embeddings update started",
+        "job_id": job_id
+    }), 202
+
+
+_NO_ITEMS = object()
+
+
+def stream_json_page(key, first, items, page):
+    """Streams {key: [...], "next_cursor": ...} item by item instead of building the whole list.
+
+    The status line is already sent, so a failure mid-page ends the document with an "error"
+    field and no next_cursor rather than truncating it.
+    """
+    yield '{"%s": [' % key
+    try:
+        if first is not _NO_ITEMS:
+            yield json.dumps(first)
+            for item in items:
+                yield ',' + json.dumps(item)
+    except Exception as e:
+        print(f"Streaming Error: {str(e)}", flush=True)
+        yield '], "next_cursor": null, "error": "Server error occurred"}'
+        return
+    yield '], "next_cursor": %s}' % json.dumps(page["next_cursor"])
+
+
+def json_page_response(key, items, page):
+    """Runs the query and reads its first batch before responding, so query errors still reach
+    handle_route_exceptions and return the usual 500 body."""
+    items = iter(items)
+    first = next(items, _NO_ITEMS)
+    return Response(stream_with_context(stream_json_page(key, first, items, page)), mimetype='application/json')
 
 
 @main_bp.route('/api/admin/users', methods=['GET'])
 @handle_route_exceptions
-def get_users():
-    organization = request.args.get('organization')
-    response, status_code = get_all_users(organization)
-    return jsonify(response), status_code
+@token_required(admin=True)
+def get_users(current_user):
+    users, page = get_all_users(request.args.get('organization'), request.args.get('cursor'),
+                                request.args.get('limit'), request.args.get('prefix'))
+    return json_page_response("users", users, page)
 
 
 @main_bp.route('/api/chat/<name>', methods=['POST'])
 @handle_route_exceptions
-def chat_with_user(name):
+@token_required
+def chat_with_user(current_user, name):
     data = request.get_json()
     organization = data.get('organization')
     chat_history = data.get('chat_history', [])
     if not chat_history:
         raise CustomException("Chat history is required")
+    if not isinstance(chat_history, list) or not all(isinstance(turn, list) and turn for turn in chat_history):
+        raise CustomException("Chat history must be a list of [question, answer] pairs")
     response, status_code = get_user_chat_response(
         name, chat_history, organization)
     return jsonify(response), status_code
 
 
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@main_bp.route('/api/chat/<name>/stream', methods=['POST'])
+@handle_route_exceptions
+@token_required
+def chat_with_user_stream(current_user, name):
+    data = request.get_json()
+    organization = data.get('organization')
+    chat_history = data.get('chat_history', [])
+    if not chat_history:
+        raise CustomException("Chat history is required")
+    if not isinstance(chat_history, list) or not all(isinstance(turn, list) and turn for turn in chat_history):
+        raise CustomException("Chat history must be a list of [question, answer] pairs")
+
+    def generate():
+        try:
+            for event, payload in stream_user_chat_response(name, chat_history, organization):
+                if event == "token":
+                    yield format_sse(event, {"text": payload})
+                else:
+                    yield format_sse(event, payload)
+        except Exception as e:
+            print(f"Streaming Error: {str(e)}", flush=True)
+            yield format_sse("error", {"error": "Server error occurred"})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @main_bp.route('/api/users/names', methods=['GET'])
 @handle_route_exceptions
-def get_user_names_route():
-    organization = request.args.get('organization')
-    response, status_code = get_user_names(organization)
-    return jsonify(response), status_code
+@token_required(admin=True)
+def get_user_names_route(current_user):
+    names, page = get_user_names(request.args.get('organization'), request.args.get('cursor'),
+                                 request.args.get('limit'), request.args.get('prefix'))
+    return json_page_response("names", names, page)
 
 
 @main_bp.route('/api/embedding-stats', methods=['GET'])
 @handle_route_exceptions
-def get_embedding_stats():
+@token_required(admin=True)
+def get_embedding_stats(current_user):
     stats, status_code = get_all_organizations_embedding_stats()
     return jsonify(stats), status_code
 
 
+@main_bp.route('/api/admin/index-cache-stats', methods=['GET'])
+@handle_route_exceptions
+@token_required(admin=True)
+def get_index_cache_stats_route(current_user):
+    stats, status_code = get_index_cache_stats()
+    return jsonify(stats), status_code
+
+
+@main_bp.route('/api/admin/cache-stats', methods=['GET'])
+@handle_route_exceptions
+@token_required(admin=True)
+def get_cache_stats_route(current_user):
+    stats, status_code = get_index_cache_stats()
+    stats["auth_cache"] = get_auth_cache_stats()
+    return jsonify(stats), status_code
+
+
 @main_bp.route('/api/admin/static-questions/<name>', methods=['GET'])
 @handle_route_exceptions
-def get_static_questions(name):
+@token_required(admin=True)
+def get_static_questions(current_user, name):
     organization = request.args.get('organization')
     result = get_question_answer_on_static_question(name, organization)
     return jsonify(result), 200
 
 
+@main_bp.route('/api/admin/static-questions/<name>', methods=['POST'])
+@handle_route_exceptions
+@token_required(admin=True)
+def recompute_static_questions(current_user, name):
+    organization = request.args.get('organization')
+    job_id = enqueue_static_answers_job(name, organization)
+    return jsonify({"job_id": job_id}), 202
+
+
+@main_bp.route('/api/admin/jobs/<job_id>', methods=['GET'])
+@handle_route_exceptions
+@token_required(admin=True)
+def get_job_route(current_user, job_id):
+    organization = request.args.get('organization')
+    response, status_code = get_job(job_id, organization)
+    return jsonify(response), status_code
+
+
+@main_bp.route('/api/admin/jobs', methods=['GET'])
+@handle_route_exceptions
+@token_required(admin=True)
+def list_jobs_route(current_user):
+    organization = request.args.get('organization')
+    response, status_code = list_jobs(organization, request.args.get('status'))
+    return jsonify(response), status_code
+
+
 @main_bp.route('/api/admin/delete-all-users', methods=['DELETE'])
 @handle_route_exceptions
-def delete_all_users_route():
+@token_required(admin=True)
+def delete_all_users_route(current_user):
     organization = request.args.get('organization')
     response, status_code = delete_all_users(organization)
     return jsonify(response), status_code
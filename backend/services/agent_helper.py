@@ -1,41 +1,137 @@
 import os
 from langchain_groq import ChatGroq
+from langchain_core.prompts import PromptTemplate
 from pathlib import Path
 import re
+import threading
+import time
 from try_catch_decorator_new import handle_exceptions
-from config.organizations import get_org_config
+from config.organizations import get_org_config, ORGANIZATIONS
+
+
+_llm_model = None
+_llm_model_lock = threading.Lock()
 
 
 @handle_exceptions
 def load_model():
-    GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-    LLM_TEMPERATURE = 0.7
+    """Returns the process-wide ChatGroq client so its HTTP connection pool is reused across requests."""
+    global _llm_model
+    if _llm_model is not None:
+        return _llm_model
+
+    with _llm_model_lock:
+        if _llm_model is None:
+            GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+            LLM_TEMPERATURE = 0.7
+
+            _llm_model = ChatGroq(
+                api_key=GROQ_API_KEY,
+                temperature=LLM_TEMPERATURE,
+                model="llama-3.3-70b-versatile",
+            )
+    return _llm_model
+
+
+PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
+QUERY_ANALYZER_PROMPT = "chatbot-query-analyzer-prompt.md"
+RAG_PROMPT = "chatbot-rag-prompt.md"
+PROMPT_INPUT_VARIABLES = {
+    QUERY_ANALYZER_PROMPT: ["chat_history", "current_question"],
+    RAG_PROMPT: ["context", "chat_history", "current_question"]
+}
+PROMPT_HOT_RELOAD = os.getenv('PROMPT_HOT_RELOAD', 'false').lower() == 'true'
+PROMPT_RELOAD_SECONDS = float(os.getenv('PROMPT_RELOAD_SECONDS', '2'))
+
+
+class PromptRegistry:
+    """Loads every prompt file once and serves pre-built PromptTemplates from memory.
+
+    With hot reload enabled, file mtimes are re-checked at most every PROMPT_RELOAD_SECONDS
+    and changed files are re-read; otherwise the hot path never touches the disk.
+    """
+
+    def __init__(self, prompts_dir, hot_reload=False, reload_seconds=2.0):
+        self.prompts_dir = prompts_dir
+        self.hot_reload = hot_reload
+        self.reload_seconds = reload_seconds
+        self._prompts = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            for prompt_file_name, input_variables in self._prompt_files().items():
+                self._load_file(prompt_file_name, input_variables)
+            self._last_check = time.monotonic()
+        return self
+
+    def get(self, prompt_file_name, organization=None):
+        """Returns (content, PromptTemplate) for a prompt file or a logical prompt name."""
+        prompt_file_name = self._resolve(prompt_file_name, organization)
+        if self.hot_reload and time.monotonic() - self._last_check >= self.reload_seconds:
+            self._reload_changed()
+        entry = self._prompts.get(prompt_file_name)
+        if entry is None:
+            with self._lock:
+                entry = self._load_file(prompt_file_name, PROMPT_INPUT_VARIABLES.get(prompt_file_name))
+        return entry["content"], entry["template"]
+
+    def _resolve(self, prompt_file_name, organization=None):
+        if prompt_file_name == RAG_PROMPT:
+            return get_org_config(organization)['prompt_files']['rag']
+        return prompt_file_name
+
+    def _prompt_files(self):
+        prompt_files = {QUERY_ANALYZER_PROMPT: PROMPT_INPUT_VARIABLES[QUERY_ANALYZER_PROMPT]}
+        for config in ORGANIZATIONS.values():
+            prompt_files[config['prompt_files']['rag']] = PROMPT_INPUT_VARIABLES[RAG_PROMPT]
+        return prompt_files
+
+    def _load_file(self, prompt_file_name, input_variables=None):
+        prompt_path = self.prompts_dir / prompt_file_name
+        mtime = prompt_path.stat().st_mtime
+        with open(prompt_path, 'r', encoding='utf-8') as file:
+            content = file.read().strip()
+        if input_variables is None:
+            template = PromptTemplate.from_template(content)
+        else:
+            template = PromptTemplate(template=content, input_variables=input_variables)
+        entry = {"content": content, "template": template, "mtime": mtime}
+        self._prompts[prompt_file_name] = entry
+        return entry
+
+    def _reload_changed(self):
+        with self._lock:
+            if time.monotonic() - self._last_check < self.reload_seconds:
+                return
+            for prompt_file_name, entry in list(self._prompts.items()):
+                if (self.prompts_dir / prompt_file_name).stat().st_mtime != entry["mtime"]:
+                    self._load_file(prompt_file_name, entry["template"].input_variables)
+                    print(f"Reloaded prompt {prompt_file_name}", flush=True)
+            self._last_check = time.monotonic()
+
+
+prompt_registry = PromptRegistry(PROMPTS_DIR, PROMPT_HOT_RELOAD, PROMPT_RELOAD_SECONDS)
+
 
-    llm_model = ChatGroq(
-        api_key=GROQ_API_KEY,
-        temperature=LLM_TEMPERATURE,
-        model="llama-3.3-70b-versatile",
-    )
-    return llm_model
+@handle_exceptions
+def load_prompt_templates():
+    return prompt_registry.load()
 
 
 @handle_exceptions
 def read_prompt_template(prompt_file_name: str, organization=None) -> str:
-    org_config = get_org_config(organization)
-    current_dir = Path(__file__).parent.parent
-    prompts_dir = current_dir / "prompts"
-
-    if prompt_file_name == "chatbot-query-analyzer-prompt.md":
-        prompt_file_name = "chatbot-query-analyzer-prompt.md"
-    elif prompt_file_name == "chatbot-rag-prompt.md":
-        prompt_file_name = org_config['prompt_files']['rag']
-
-    prompt_path = prompts_dir / prompt_file_name
-    with open(prompt_path, 'r', encoding='utf-8') as file:
-        content = file.read().strip()
+    content, _ = prompt_registry.get(prompt_file_name, organization)
     return content
 
 
+@handle_exceptions
+def get_prompt_template(prompt_file_name: str, organization=None) -> PromptTemplate:
+    _, template = prompt_registry.get(prompt_file_name, organization)
+    return template
+
+
 @handle_exceptions
 def parse_intention_response(xml_response: str, state: dict) -> dict:
     response_match = re.search(
@@ -64,3 +160,77 @@ def parse_llm_response(xml_response: str) -> str:
         return None if response.lower() == "none" else response
 
     return None
+
+
+class ResponseStreamFilter:
+    """Incrementally strips the <response> wrapper from a streamed LLM answer.
+
+    Mirrors parse_llm_response: surrounding whitespace is dropped and a bare "None" answer
+    yields nothing, so text that could still turn out to be "None" is held back.
+    """
+
+    OPEN_TAG = "<response>"
+    CLOSE_TAG = "</response>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._content = ""
+        self._emitted = 0
+        self._inside = False
+        self._closed = False
+
+    def feed(self, chunk: str) -> str:
+        if self._closed:
+            return ""
+        self._buffer += chunk
+
+        if not self._inside:
+            start = self._buffer.find(self.OPEN_TAG)
+            if start == -1:
+                self._buffer = self._buffer[-(len(self.OPEN_TAG) - 1):]
+                return ""
+            self._buffer = self._buffer[start + len(self.OPEN_TAG):]
+            self._inside = True
+
+        end = self._buffer.find(self.CLOSE_TAG)
+        if end != -1:
+            self._content += self._buffer[:end]
+            self._buffer = ""
+            self._closed = True
+            return self._visible(final=True)
+
+        held = self._partial_close_length()
+        self._content += self._buffer[:len(self._buffer) - held]
+        self._buffer = self._buffer[len(self._buffer) - held:]
+        return self._visible(final=False)
+
+    def finish(self) -> str:
+        """Flushes held-back text; an unterminated <response> is accepted as complete."""
+        if self._inside and not self._closed:
+            self._buffer = ""
+            self._closed = True
+            return self._visible(final=True)
+        return ""
+
+    @property
+    def response(self):
+        if not self._inside:
+            return None
+        response = self._content.strip()
+        return None if response.lower() == "none" else response
+
+    def _partial_close_length(self):
+        for length in range(len(self.CLOSE_TAG) - 1, 0, -1):
+            if self._buffer.endswith(self.CLOSE_TAG[:length]):
+                return length
+        return 0
+
+    def _visible(self, final):
+        text = self._content.strip() if final else self._content.lstrip().rstrip()
+        if final and text.lower() == "none":
+            return ""
+        if not final and "none".startswith(text.lower()):
+            return ""
+        new_text = text[self._emitted:]
+        self._emitted = len(text)
+        return new_text
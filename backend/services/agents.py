@@ -1,13 +1,23 @@
-from typing import Dict, TypedDict, List
-from langchain_core.messages import BaseMessage, HumanMessage
-from langgraph.graph import StateGraph, Graph, END
-from langchain_core.prompts import PromptTemplate
+import threading
+from typing import Annotated, Any, Dict, TypedDict, List
+from langchain_core.messages import BaseMessage
+from langgraph.graph import StateGraph, Graph, START, END
 from langchain_core.output_parsers import StrOutputParser
-from .agent_helper import load_model, read_prompt_template, parse_intention_response, parse_llm_response
-from .embedding_service import get_relevant_chunks
+from .agent_helper import (load_model, get_prompt_template, load_prompt_templates, parse_intention_response,
+                           parse_llm_response, ResponseStreamFilter, QUERY_ANALYZER_PROMPT, RAG_PROMPT)
+import asyncio
+from .embedding_service import (get_relevant_chunks, aget_relevant_chunks, embed_query, aembed_query,
+                                prefetch_user_index, get_embeddings_version, get_cached_response, cache_response,
+                                RESPONSE_CACHE_ENABLED)
+from .metrics import span, node_span
+from .prompt_budget import format_history, fit_context, get_prompt_budget, record_prompt_tokens
 from try_catch_decorator_new import handle_exceptions
 
 
+def merge_prompt_tokens(current, update):
+    return {**(current or {}), **(update or {})}
+
+
 class AgentState(TypedDict):
     messages: List[BaseMessage]
     greeting: bool
@@ -15,64 +25,224 @@ class AgentState(TypedDict):
     current_question: str
     response: str
     standalone_question: str
+    query_embedding: List[float]
+    embeddings_version: str
+    cache_hit: bool
     username: str
     organization: str
+    prompt_tokens: Annotated[Dict[str, Dict[str, int]], merge_prompt_tokens]
+    prefetch: Any
 
 
 @handle_exceptions
-def create_user_intention_node(state):
-    llm = load_model()
-    prompt = read_prompt_template(
-        "chatbot-query-analyzer-prompt.md", state["organization"])
-    prompt_template = PromptTemplate(template=prompt, input_variables=[
-                                     "chat_history", "current_question"])
-
-    chat_history = "Empty" if not state["messages"] else state["messages"]
-    current_question = state["current_question"]
-
-    answer_check_chain = prompt_template | llm | StrOutputParser()
-    response = answer_check_chain.invoke({
-        "chat_history": chat_history,
-        "current_question": current_question
-    })
+def get_intention_chain(organization=None):
+    prompt_template = get_prompt_template(QUERY_ANALYZER_PROMPT, organization)
+    return prompt_template | load_model() | StrOutputParser()
+
+
+@handle_exceptions
+def build_intention_inputs(state):
+    return {
+        "chat_history": format_history(state["messages"]),
+        "current_question": state["current_question"]
+    }
+
+
+@handle_exceptions
+def apply_intention_response(state, response, prompt_tokens):
     response, greeting, standalone = parse_intention_response(response, state)
-    state["response"] = response
-    state["greeting"] = greeting
-    state["standalone_question"] = standalone
-    return state
+    return {
+        "response": response,
+        "greeting": greeting,
+        "standalone_question": standalone,
+        "prompt_tokens": {"intent": prompt_tokens}
+    }
 
 
 @handle_exceptions
-def create_rag_node(state):
-    llm = load_model()
-    relevant_chunks = get_relevant_chunks(
-        state["username"], state["current_question"], state["organization"])
-    context = "Empty" if not relevant_chunks else "\n".join(relevant_chunks)
-
-    # Convert messages to chat history string format
-    chat_history = "Empty"
-    if state["messages"]:
-        chat_history = "\n".join([
-            f"User: {msg.content}" if isinstance(msg, HumanMessage)
-            else f"Assistant: {msg.content}"
-            for msg in state["messages"]
-        ])
-
-    prompt = read_prompt_template(
-        "chatbot-rag-prompt.md", state["organization"])
-    prompt_template = PromptTemplate(template=prompt, input_variables=[
-                                     "context", "chat_history", "current_question"])
-
-    answer_check_chain = prompt_template | llm | StrOutputParser()
-    response = answer_check_chain.invoke({
-        "context": context,
-        "chat_history": chat_history,
+def create_user_intention_node(state):
+    with node_span("user_intention", state["organization"]):
+        inputs = build_intention_inputs(state)
+        prompt_tokens = record_prompt_tokens("intent", state["organization"], **inputs)
+        with span("intent_llm", state["organization"]):
+            response = get_intention_chain(state["organization"]).invoke(inputs)
+        return apply_intention_response(state, response, prompt_tokens)
+
+
+@handle_exceptions
+async def acreate_user_intention_node(state):
+    with node_span("user_intention", state["organization"]):
+        inputs = build_intention_inputs(state)
+        prompt_tokens = record_prompt_tokens("intent", state["organization"], **inputs)
+        with span("intent_llm", state["organization"]):
+            response = await get_intention_chain(state["organization"]).ainvoke(inputs)
+        return apply_intention_response(state, response, prompt_tokens)
+
+
+@handle_exceptions
+def format_rag_inputs(state, relevant_chunks):
+    """Builds the RAG prompt inputs, with retrieved context capped to the org's context budget."""
+    relevant_chunks = fit_context(relevant_chunks, get_prompt_budget(state["organization"])['context_tokens'])
+    return {
+        "context": "Empty" if not relevant_chunks else "\n".join(relevant_chunks),
+        "chat_history": format_history(state["messages"]),
         "current_question": state["current_question"]
-    })
+    }
+
+
+@handle_exceptions
+def create_index_prefetch(state):
+    """Loads the user's index while intent analysis runs and returns the user's embeddings version.
+
+    Runs as a background prefetch started before the graph (see chatbot_service), so greeting
+    turns, which discard it, never wait on it. The query itself is embedded only once, after
+    intent analysis has produced the standalone question.
+    """
+    with node_span("retrieval", state["organization"]):
+        return prefetch_user_index(state["username"], state["organization"])
+
+
+@handle_exceptions
+def rag_query(state):
+    """The query retrieval should use: the standalone question when intent analysis produced one."""
+    standalone = state.get("standalone_question")
+    if standalone and standalone.strip().lower() != "none":
+        return standalone.strip()
+    return state["current_question"]
+
+
+@handle_exceptions
+def resolve_embeddings_version(state):
+    """The version the answer cache checked, else the prefetch's, else a fresh lookup."""
+    if state.get("embeddings_version") is not None:
+        return state["embeddings_version"]
+    if state.get("prefetch") is not None:
+        return state["prefetch"].result()
+    return get_embeddings_version(state["username"], state["organization"])
+
+
+@handle_exceptions
+async def aresolve_embeddings_version(state):
+    if state.get("embeddings_version") is not None:
+        return state["embeddings_version"]
+    if state.get("prefetch") is not None:
+        return await state["prefetch"]
+    return await asyncio.to_thread(get_embeddings_version, state["username"], state["organization"])
+
+
+@handle_exceptions
+def resolve_rag_context(state):
+    """Retrieves for the standalone question, reusing the answer cache's query embedding.
+
+    A caller that already retrieved (e.g. the static-answer batch) passes the chunks as `context`.
+    """
+    if state.get("context") is not None:
+        return state["context"]
+    return get_relevant_chunks(state["username"], rag_query(state), state["organization"],
+                               query_embedding=state.get("query_embedding"), version=resolve_embeddings_version(state))
+
+
+@handle_exceptions
+async def aresolve_rag_context(state):
+    if state.get("context") is not None:
+        return state["context"]
+    return await aget_relevant_chunks(state["username"], rag_query(state), state["organization"],
+                                      query_embedding=state.get("query_embedding"),
+                                      version=await aresolve_embeddings_version(state))
+
+
+@handle_exceptions
+def apply_cached_response(state, query_embedding, version):
+    cached = get_cached_response(state["username"], state["organization"], version, query_embedding)
+    update = {
+        "query_embedding": query_embedding,
+        "embeddings_version": version,
+        "cache_hit": cached is not None
+    }
+    if cached is not None:
+        update["response"] = cached
+    return update
 
-    response = parse_llm_response(response)
-    state["response"] = response
-    return state
+
+@handle_exceptions
+def create_answer_cache_node(state):
+    """Answers from the semantic response cache when a near-identical standalone question was seen."""
+    if not RESPONSE_CACHE_ENABLED:
+        return {"cache_hit": False}
+    with node_span("answer_cache", state["organization"]):
+        query_embedding = embed_query(rag_query(state), state["organization"])
+        version = resolve_embeddings_version(state)
+        return apply_cached_response(state, query_embedding, version)
+
+
+@handle_exceptions
+async def acreate_answer_cache_node(state):
+    if not RESPONSE_CACHE_ENABLED:
+        return {"cache_hit": False}
+    with node_span("answer_cache", state["organization"]):
+        query_embedding, version = await asyncio.gather(
+            aembed_query(rag_query(state), state["organization"]),
+            aresolve_embeddings_version(state)
+        )
+        return apply_cached_response(state, query_embedding, version)
+
+
+@handle_exceptions
+def store_rag_response(state, response):
+    cache_response(state["username"], state["organization"], state.get("embeddings_version"),
+                   state.get("query_embedding"), response)
+
+
+@handle_exceptions
+def get_rag_chain(organization=None):
+    prompt_template = get_prompt_template(RAG_PROMPT, organization)
+    return prompt_template | load_model() | StrOutputParser()
+
+
+@handle_exceptions
+def create_rag_node(state):
+    with node_span("rag", state["organization"]):
+        rag_inputs = format_rag_inputs(state, resolve_rag_context(state))
+        with span("rag_llm", state["organization"]):
+            response = get_rag_chain(state["organization"]).invoke(rag_inputs)
+
+        response = parse_llm_response(response)
+        store_rag_response(state, response)
+        return {"response": response,
+                "prompt_tokens": {"rag": record_prompt_tokens("rag", state["organization"], **rag_inputs)}}
+
+
+@handle_exceptions
+async def acreate_rag_node(state):
+    with node_span("rag", state["organization"]):
+        rag_inputs = format_rag_inputs(state, await aresolve_rag_context(state))
+        with span("rag_llm", state["organization"]):
+            response = await get_rag_chain(state["organization"]).ainvoke(rag_inputs)
+
+        response = parse_llm_response(response)
+        store_rag_response(state, response)
+        return {"response": response,
+                "prompt_tokens": {"rag": record_prompt_tokens("rag", state["organization"], **rag_inputs)}}
+
+
+@handle_exceptions
+def stream_rag_node(state):
+    """Yields answer text as the RAG LLM streams it, with the <response> wrapper filtered out."""
+    with node_span("rag", state["organization"]):
+        rag_inputs = format_rag_inputs(state, resolve_rag_context(state))
+    response_filter = ResponseStreamFilter()
+    with span("rag_llm", state["organization"], node="rag"):
+        for chunk in get_rag_chain(state["organization"]).stream(rag_inputs):
+            text = response_filter.feed(chunk)
+            if text:
+                yield text
+    text = response_filter.finish()
+    if text:
+        yield text
+    state["response"] = response_filter.response
+    state["prompt_tokens"] = merge_prompt_tokens(
+        state.get("prompt_tokens"), {"rag": record_prompt_tokens("rag", state["organization"], **rag_inputs)})
+    store_rag_response(state, state["response"])
 
 
 @handle_exceptions
@@ -83,18 +253,38 @@ def rag_needed(state):
 
 
 @handle_exceptions
-def nodes_of_graph(workflow: StateGraph):
-    workflow.add_node("user_intention", create_user_intention_node)
-    workflow.add_node("rag", create_rag_node)
+def answer_needed(state):
+    return not state.get("cache_hit")
+
+
+@handle_exceptions
+def nodes_of_graph(workflow: StateGraph, use_async=False):
+    if use_async:
+        workflow.add_node("user_intention", acreate_user_intention_node)
+        workflow.add_node("answer_cache", acreate_answer_cache_node)
+        workflow.add_node("rag", acreate_rag_node)
+    else:
+        workflow.add_node("user_intention", create_user_intention_node)
+        workflow.add_node("answer_cache", create_answer_cache_node)
+        workflow.add_node("rag", create_rag_node)
     return workflow
 
 
 @handle_exceptions
 def flow_of_graph(workflow: StateGraph):
-    workflow.set_entry_point("user_intention")
+    # Retrieval is prefetched outside the graph while intent analysis runs; "rag" waits on it.
+    workflow.add_edge(START, "user_intention")
     workflow.add_conditional_edges(
         "user_intention",
         rag_needed,
+        {
+            True: "answer_cache",
+            False: END
+        }
+    )
+    workflow.add_conditional_edges(
+        "answer_cache",
+        answer_needed,
         {
             True: "rag",
             False: END
@@ -106,8 +296,35 @@ def flow_of_graph(workflow: StateGraph):
 
 
 @handle_exceptions
-def create_agent_graph() -> Graph:
+def create_agent_graph(use_async=False) -> Graph:
     workflow = StateGraph(AgentState)
-    workflow = nodes_of_graph(workflow)
+    workflow = nodes_of_graph(workflow, use_async)
     workflow = flow_of_graph(workflow)
     return workflow.compile()
+
+
+_agent_graphs = {}
+_agent_graph_lock = threading.Lock()
+
+
+@handle_exceptions
+def get_agent_graph(use_async=False) -> Graph:
+    """Returns the compiled agent graph, building it once per process.
+
+    The async variant has coroutine nodes and must be run with `ainvoke`.
+    """
+    graph = _agent_graphs.get(use_async)
+    if graph is not None:
+        return graph
+
+    with _agent_graph_lock:
+        if use_async not in _agent_graphs:
+            _agent_graphs[use_async] = create_agent_graph(use_async)
+    return _agent_graphs[use_async]
+
+
+@handle_exceptions
+def warm_up_agent(use_async=False):
+    load_prompt_templates()
+    load_model()
+    get_agent_graph(use_async)
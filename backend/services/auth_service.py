@@ -1,39 +1,47 @@
 import jwt
+import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta
 import os
 from database import mongo
+from config.organizations import ORGANIZATIONS, DEFAULT_ORG
+from services.lru_cache import LRUCache
 from try_catch_decorator_new import handle_exceptions
 
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', 'false').lower() == 'true'
+
+principal_cache = LRUCache(max_entries=AUTH_CACHE_SIZE)
+
+ORG_PREFIXES = {
+    'rs_': 'real_estate',
+    'mf_': 'manufacturing',
+    'fn_': 'finance',
+    'gn_': 'general'
+}
+
 
 @handle_exceptions
 def authenticate_user(name, password):
     if not name or not password:
         raise ValueError("Name and password are required")
 
-    org_map = {
-        'rs_': 'real_estate',
-        'mf_': 'manufacturing',
-        'fn_': 'finance',
-        'gn_': 'general'
-    }
-
     prefix = name[:3]
-    determined_org = org_map.get(prefix)
+    determined_org = ORG_PREFIXES.get(prefix)
 
     if not determined_org:
         raise ValueError("Invalid username format")
 
-    print(determined_org)
-    print(name)
-    print(password)
-
     db = mongo.get_db(determined_org)
-    user = db.users.find_one({"name": name})
+    user = db.users.find_one({"name": name}, {"_id": 0, "password": 1, "is_admin": 1})
 
-    if not user or user['password'] != password:
+    if not user or not hmac.compare_digest(str(user.get('password', '')).encode('utf-8'),
+                                           str(password).encode('utf-8')):
         raise ValueError("Invalid credentials")
 
-    token = jwt.encode({'name': name, 'is_admin': user.get('is_admin', False),
+    token = jwt.encode({'name': name, 'is_admin': user.get('is_admin', False), 'organization': determined_org,
                        'exp': datetime.utcnow() + timedelta(hours=24)}, os.getenv('SECRET_KEY'))
 
     return {"token": token, "is_admin": user.get('is_admin', False), "organization": determined_org}, 200
@@ -41,10 +49,87 @@ def authenticate_user(name, password):
 
 @handle_exceptions
 def verify_token(token, organization=None):
-    data = jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=['HS256'])
-    db = mongo.get_db(organization)
-    current_user = db.users.find_one({'name': data['name']})
-    return current_user, None
+    """Returns (principal, None) or (None, (message, status)).
+
+    Verified principals are cached by token hash until the earlier of AUTH_CACHE_TTL and the
+    token's `exp`, so repeat requests skip both the JWT decode and the users lookup.
+    """
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    org_key = organization if organization in ORGANIZATIONS else None
+    cache_key = (token_hash, org_key)
+    principal = principal_cache.get(cache_key)
+    if principal is not None:
+        return principal, None
+
+    try:
+        data = jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, ("Token has expired", 401)
+    except jwt.InvalidTokenError:
+        return None, ("Invalid token", 401)
+
+    user_org = org_key or data.get('organization') or DEFAULT_ORG
+    db = mongo.get_db(user_org)
+    current_user = db.users.find_one({'name': data['name']}, {"_id": 0, "name": 1, "is_admin": 1})
+    if not current_user:
+        return None, ("User not found", 401)
+
+    principal = {
+        "name": current_user['name'],
+        "is_admin": current_user.get('is_admin', False),
+        "organization": user_org
+    }
+    ttl = min(AUTH_CACHE_TTL, data['exp'] - time.time()) if 'exp' in data else AUTH_CACHE_TTL
+    if ttl > 0:
+        principal_cache.set(cache_key, principal, ttl=ttl)
+    return principal, None
+
+
+def parse_bearer_token(authorization):
+    parts = (authorization or '').split(' ')
+    if len(parts) != 2 or parts[0] != 'Bearer' or parts[1] in ('', 'null', 'undefined'):
+        return None
+    return parts[1]
+
+
+@handle_exceptions
+def authorize_request(authorization, organization=None, admin=False):
+    """Resolves the caller of a request from its Authorization header, for every HTTP entry point.
+
+    Returns (principal, None) or (None, (message, status)). Admin requests always need a valid
+    admin token; other requests without a token are anonymous (None, None) unless AUTH_REQUIRED is set.
+    """
+    token = parse_bearer_token(authorization)
+    if not token:
+        if AUTH_REQUIRED or admin:
+            return None, ("Token is missing", 401)
+        return None, None
+
+    user, error = verify_token(token, organization)
+    if error:
+        return None, error
+    if admin and not admin_required(user):
+        return None, ("Admin access required", 403)
+    return user, None
+
+
+@handle_exceptions
+def invalidate_user_principals(name, organization=None):
+    org_key = organization if organization in ORGANIZATIONS else DEFAULT_ORG
+    return principal_cache.invalidate_items_where(
+        lambda key, principal: principal["name"] == name and principal["organization"] == org_key)
+
+
+@handle_exceptions
+def invalidate_organization_principals(organization=None):
+    org_key = organization if organization in ORGANIZATIONS else DEFAULT_ORG
+    return principal_cache.invalidate_items_where(
+        lambda key, principal: principal["organization"] == org_key)
+
+
+@handle_exceptions
+def get_auth_cache_stats():
+    return principal_cache.stats()
 
 
 @handle_exceptions
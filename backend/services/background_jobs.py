@@ -0,0 +1,50 @@
+from database import mongo
+from services.job_queue import job_queue
+from services.embedding_service import save_user_embeddings, modify_user_embeddings
+from services.save_static_question import question_answering_on_static_question
+from try_catch_decorator_new import handle_exceptions
+
+
+@handle_exceptions
+def run_create_user_job(name, text, organization=None):
+    response, _ = save_user_embeddings(name, text, organization)
+    response["static_answers_job_id"] = enqueue_static_answers_job(name, organization)
+    return response
+
+
+@handle_exceptions
+def run_modify_user_job(name, text, organization=None):
+    response, _ = modify_user_embeddings(name, text, organization)
+    return response
+
+
+@handle_exceptions
+def run_static_answers_job(name, organization=None):
+    answers = question_answering_on_static_question(name, organization)
+    return {"answers": len(answers)}
+
+
+job_queue.register("create_user", run_create_user_job)
+job_queue.register("modify_user", run_modify_user_job)
+job_queue.register("static_answers", run_static_answers_job)
+
+
+@handle_exceptions
+def enqueue_create_user_job(name, text, organization=None):
+    return job_queue.enqueue("create_user", organization, {"name": name, "text": text})
+
+
+@handle_exceptions
+def enqueue_modify_user_job(name, text, organization=None):
+    return job_queue.enqueue("modify_user", organization, {"name": name, "text": text})
+
+
+@handle_exceptions
+def enqueue_static_answers_job(name, organization=None):
+    return job_queue.enqueue("static_answers", organization, {"name": name})
+
+
+@handle_exceptions
+def recover_jobs():
+    """Recovers each org's interrupted jobs when this process first connects to it, not at startup."""
+    mongo.add_connect_hook(job_queue.recover)
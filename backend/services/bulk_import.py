@@ -0,0 +1,165 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pymongo.errors import BulkWriteError
+from database import mongo
+from config.organizations import ORGANIZATIONS
+from services.embedding_service import chunk_text, embed_chunks, store_user_index
+from services.background_jobs import enqueue_static_answers_job
+from try_catch_decorator_new import handle_exceptions, CustomException
+
+BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', '200'))
+BULK_IMPORT_UPLOAD_WORKERS = int(os.getenv('BULK_IMPORT_UPLOAD_WORKERS', '8'))
+IMPORT_FIELDS = ("name", "password", "organization", "text")
+
+
+@handle_exceptions
+def parse_import_rows(stream, file_format="jsonl"):
+    """Yields (line, row) pairs from a JSONL or CSV text stream without reading it all into memory."""
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, {"_error": "Invalid JSON"}
+    else:
+        raise CustomException("Format must be jsonl or csv")
+
+
+def _row_error(line, row, error):
+    return {"line": line, "name": row.get("name") if isinstance(row, dict) else None,
+            "status": "error", "error": error}
+
+
+def _validate_row(row):
+    if not isinstance(row, dict):
+        return "Row must be an object"
+    if row.get("_error"):
+        return row["_error"]
+    if any(not row.get(field) for field in IMPORT_FIELDS):
+        return "Name, password, organization and text are required"
+    if row["organization"] not in ORGANIZATIONS:
+        return "Unknown organization"
+    return None
+
+
+def _import_organization_batch(organization, entries, static_answers, executor):
+    """Imports one organization's slice of a batch and returns a result per entry."""
+    db = mongo.get_db(organization)
+    results = {}
+
+    names = [row["name"] for _, row in entries]
+    existing = {user["name"] for user in db.users.find({"name": {"$in": names}}, {"_id": 0, "name": 1})}
+    accepted = []
+    seen = set()
+    for line, row in entries:
+        if row["name"] in existing or row["name"] in seen:
+            results[line] = _row_error(line, row, "Name already exists")
+            continue
+        chunks = chunk_text(row["text"])
+        if not chunks:
+            results[line] = _row_error(line, row, "No valid text chunks found")
+            continue
+        seen.add(row["name"])
+        accepted.append((line, row, chunks))
+
+    if not accepted:
+        return results
+
+    # Users are inserted before any index is written, so a name taken by a concurrent writer
+    # fails here and never overwrites that tenant's embeddings.
+    created_at = datetime.utcnow()
+    inserted = {line for line, _, _ in accepted}
+    try:
+        db.users.insert_many([
+            {"name": row["name"], "password": row["password"], "created_at": created_at}
+            for _, row, _ in accepted
+        ], ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            line, row, _ = accepted[error["index"]]
+            inserted.discard(line)
+            results[line] = _row_error(line, row, "Name already exists")
+    accepted = [entry for entry in accepted if entry[0] in inserted]
+    if not accepted:
+        return results
+
+    try:
+        all_chunks = [chunk for _, _, chunks in accepted for chunk in chunks]
+        vectors, _ = embed_chunks(all_chunks, organization)
+    except Exception:
+        _remove_users(db, [row["name"] for _, row, _ in accepted])
+        raise
+
+    uploads = {}
+    offset = 0
+    for line, row, chunks in accepted:
+        user_vectors = vectors[offset:offset + len(chunks)]
+        offset += len(chunks)
+        uploads[line] = executor.submit(store_user_index, row["name"], user_vectors, chunks, organization)
+
+    failed = []
+    for line, row, chunks in accepted:
+        try:
+            uploads[line].result()
+        except Exception as e:
+            failed.append(row["name"])
+            results[line] = _row_error(line, row, f"Failed to store embeddings: {str(e)}")
+            continue
+        result = {"line": line, "name": row["name"], "status": "created", "chunks": len(chunks)}
+        if static_answers:
+            result["static_answers_job_id"] = enqueue_static_answers_job(row["name"], organization)
+        results[line] = result
+    _remove_users(db, failed)
+    return results
+
+
+def _remove_users(db, names):
+    """Rolls back users whose embeddings could not be stored, so the rows can be imported again."""
+    if names:
+        db.users.delete_many({"name": {"$in": names}})
+
+
+@handle_exceptions
+def bulk_import_users(rows, static_answers=True, batch_size=None):
+    """Imports (line, row) pairs in batches and yields one result dict per row.
+
+    Each batch does one existence query and one insert_many per organization, sends all new
+    chunks to the embedding model in large requests, and uploads indexes concurrently.
+    """
+    batch_size = batch_size or BULK_IMPORT_BATCH_SIZE
+    rows = iter(rows)
+    with ThreadPoolExecutor(max_workers=BULK_IMPORT_UPLOAD_WORKERS) as executor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+
+            results = {}
+            by_organization = {}
+            for line, row in batch:
+                error = _validate_row(row)
+                if error:
+                    results[line] = _row_error(line, row, error)
+                else:
+                    by_organization.setdefault(row["organization"], []).append((line, row))
+
+            for organization, entries in by_organization.items():
+                try:
+                    results.update(_import_organization_batch(organization, entries, static_answers, executor))
+                except Exception as e:
+                    print(f"Bulk import batch failed for {organization}: {str(e)}", flush=True)
+                    for line, row in entries:
+                        results.setdefault(line, _row_error(line, row, "Server error occurred"))
+
+            for line, _ in batch:
+                yield results[line]
@@ -1,40 +1,136 @@
-from .agents import create_agent_graph
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from .agents import (get_agent_graph, create_user_intention_node, create_index_prefetch, create_answer_cache_node,
+                     rag_needed, answer_needed, stream_rag_node)
+from .prompt_budget import get_prompt_budget, truncate_to_tokens, trim_history, record_dropped_messages
 from langchain_core.messages import HumanMessage, AIMessage
 from try_catch_decorator_new import handle_exceptions
 
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('RETRIEVAL_PREFETCH_WORKERS', '16')), thread_name_prefix='retrieval')
+
 
 @handle_exceptions
 def get_initial_state(question, chat_history, username, organization):
     initial_state = {
         "messages": chat_history,
         "intent": "",
-        "context": [],
+        "context": None,
         "current_question": question,
         "response": "",
         "standalone_question": "",
+        "query_embedding": None,
+        "embeddings_version": None,
+        "cache_hit": False,
         "username": username,
-        "organization": organization
+        "organization": organization,
+        "prompt_tokens": {},
+        "prefetch": None
     }
     return initial_state
 
 
 @handle_exceptions
-def get_user_chat_response(name, chat_history, organization):
-    """Generates a chat response for a user based on their chat history."""
+def start_retrieval_prefetch(state):
+    """Starts loading the user's index in a worker thread; the cache and RAG nodes wait on the future."""
+    return retrieval_executor.submit(contextvars.copy_context().run, create_index_prefetch, dict(state))
+
+
+def _discard_prefetch(task):
+    """Greeting and cached turns never await the prefetch task; retrieve its outcome so it is not logged."""
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+@handle_exceptions
+def build_chat_messages(chat_history, organization=None):
+    """Splits [[question, answer], ...] into the latest question and the prior turns as messages.
+
+    Only the org's last `max_turns` turns are read; the question is cut to its token budget and
+    the prior turns are trimmed to the history budget.
+    """
+    budget = get_prompt_budget(organization)
+    chat_history = chat_history[-max(1, budget['max_turns']):]
     last_interaction = chat_history[-1]
-    last_question = last_interaction[0]
+    last_question = truncate_to_tokens(str(last_interaction[0]), budget['question_tokens'])
     previous_chat_history = chat_history[:-1]
     messages = []
     for msg in previous_chat_history:
-        messages.append(HumanMessage(content=msg[0]))
-        if msg[1]:
-            messages.append(AIMessage(content=msg[1]))
-    graph = create_agent_graph()
+        messages.append(HumanMessage(content=str(msg[0])))
+        if len(msg) > 1 and msg[1]:
+            messages.append(AIMessage(content=str(msg[1])))
+    messages, dropped = trim_history(messages, budget['history_tokens'])
+    record_dropped_messages(dropped, organization)
+    return last_question, messages
+
+
+@handle_exceptions
+def get_user_chat_response(name, chat_history, organization):
+    """Generates a chat response for a user based on their chat history."""
+    last_question, messages = build_chat_messages(chat_history, organization)
+    graph = get_agent_graph()
     initial_state = get_initial_state(
         last_question, messages, name, organization)
+    initial_state["prefetch"] = start_retrieval_prefetch(initial_state)
     final_state = graph.invoke(initial_state)
-    ai_response = final_state["response"]
-    print("ai_response", ai_response, flush=True)
     return {
-        "response": ai_response,
+        "response": final_state["response"],
     }, 200
+
+
+@handle_exceptions
+async def aget_user_chat_response(name, chat_history, organization):
+    """Async get_user_chat_response; runs the coroutine-node graph without blocking the event loop."""
+    last_question, messages = build_chat_messages(chat_history, organization)
+    graph = get_agent_graph(use_async=True)
+    initial_state = get_initial_state(
+        last_question, messages, name, organization)
+    initial_state["prefetch"] = asyncio.ensure_future(asyncio.to_thread(create_index_prefetch, dict(initial_state)))
+    _discard_prefetch(initial_state["prefetch"])
+    final_state = await graph.ainvoke(initial_state)
+    return {
+        "response": final_state["response"],
+    }, 200
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+@handle_exceptions
+def stream_user_chat_response(name, chat_history, organization):
+    """Yields ("token", text) events as the answer is generated, then one ("done", payload) event.
+
+    Runs the same nodes as the compiled graph, with the index prefetched in a worker thread
+    while intent analysis runs, but streams the RAG LLM call.
+    """
+    started = time.perf_counter()
+    timing = {}
+    last_question, messages = build_chat_messages(chat_history, organization)
+    state = get_initial_state(last_question, messages, name, organization)
+
+    state["prefetch"] = start_retrieval_prefetch(state)
+    state.update(create_user_intention_node(state))
+    timing["intent_ms"] = _elapsed_ms(started)
+
+    if rag_needed(state):
+        state.update(create_answer_cache_node(state))
+
+    if not rag_needed(state) or not answer_needed(state):
+        if state["response"]:
+            timing["first_token_ms"] = _elapsed_ms(started)
+            yield "token", state["response"]
+    else:
+        retrieval_started = time.perf_counter()
+        wait([state["prefetch"]])
+        timing["retrieval_wait_ms"] = _elapsed_ms(retrieval_started)
+        for text in stream_rag_node(state):
+            if "first_token_ms" not in timing:
+                timing["first_token_ms"] = _elapsed_ms(started)
+            yield "token", text
+
+    timing["total_ms"] = _elapsed_ms(started)
+    yield "done", {"response": state["response"], "cached": state["cache_hit"], "timing": timing,
+                   "prompt_tokens": state["prompt_tokens"]}
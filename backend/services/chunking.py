@@ -0,0 +1,112 @@
+import os
+import re
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from services.tokens import count_tokens
+
+CHUNK_SIZE_UNIT = os.getenv('CHUNK_SIZE_UNIT', 'chars')
+CHUNK_MAX_SIZE = int(os.getenv('CHUNK_MAX_SIZE', '1200'))
+CHUNK_MIN_SIZE = int(os.getenv('CHUNK_MIN_SIZE', '200'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '100'))
+
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+# Oversized paragraphs are cut at line breaks first, then sentence ends, then words.
+SPLIT_SEPARATORS = ['\n', '. ', '? ', '! ', '; ', ', ', ' ', '']
+
+LENGTH_FUNCTIONS = {
+    'chars': len,
+    'tokens': count_tokens
+}
+
+
+def _length_function(unit):
+    if unit not in LENGTH_FUNCTIONS:
+        raise ValueError(f"Unknown chunk size unit: {unit}")
+    return LENGTH_FUNCTIONS[unit]
+
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def iter_paragraph_spans(text):
+    """Yields (start, end) offsets of the non-blank paragraphs in `text`, without copying it."""
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        span = _strip_span(text, start, match.start())
+        if span[0] < span[1]:
+            yield span
+        start = match.end()
+    span = _strip_span(text, start, len(text))
+    if span[0] < span[1]:
+        yield span
+
+
+def _split_span(text, start, end, splitter, overlap):
+    """Splits one oversized paragraph into overlapping pieces, mapped back to offsets in `text`."""
+    paragraph = text[start:end]
+    cursor = 0
+    for piece in splitter.split_text(paragraph):
+        offset = paragraph.find(piece, max(0, cursor - overlap))
+        if offset < 0:
+            offset = paragraph.find(piece)
+        yield start + offset, start + offset + len(piece)
+        cursor = offset + len(piece)
+
+
+def iter_chunk_spans(text, max_size=None, min_size=None, overlap=None, unit=None):
+    """Yields (start, end) offsets of chunks no longer than `max_size`.
+
+    Consecutive paragraphs are merged until a chunk reaches `min_size`; a paragraph longer than
+    `max_size` is split on its own, each piece sharing up to `overlap` with the previous one.
+    Sizes are in characters or approximate tokens, depending on `unit`.
+    """
+    max_size = CHUNK_MAX_SIZE if max_size is None else max_size
+    min_size = CHUNK_MIN_SIZE if min_size is None else min_size
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    length = _length_function(unit or CHUNK_SIZE_UNIT)
+    if max_size <= 0:
+        raise ValueError("Chunk size must be positive")
+    overlap = min(overlap, max_size // 2)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=max_size, chunk_overlap=overlap,
+                                              length_function=length, separators=SPLIT_SEPARATORS,
+                                              keep_separator='end')
+
+    pending = None
+    for start, end in iter_paragraph_spans(text):
+        if length(text[start:end]) > max_size:
+            if pending:
+                yield pending
+                pending = None
+            yield from _split_span(text, start, end, splitter, overlap)
+            continue
+        if pending is None:
+            pending = (start, end)
+        elif length(text[pending[0]:end]) > max_size:
+            yield pending
+            pending = (start, end)
+        else:
+            pending = (pending[0], end)
+        if length(text[pending[0]:pending[1]]) >= min_size:
+            yield pending
+            pending = None
+    if pending:
+        yield pending
+
+
+def iter_chunk_documents(text, source=None, **options):
+    """Streams chunks of `text` as Documents carrying chunk_id, chunk_index and start/end offsets."""
+    for index, (start, end) in enumerate(iter_chunk_spans(text, **options)):
+        metadata = {
+            "chunk_id": f"{source}:{index}" if source else str(index),
+            "chunk_index": index,
+            "start": start,
+            "end": end
+        }
+        if source:
+            metadata["source"] = source
+        yield Document(page_content=text[start:end], metadata=metadata)
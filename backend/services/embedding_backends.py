@@ -0,0 +1,212 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from langchain_community.embeddings import JinaEmbeddings
+from langchain_community.embeddings.jina import JINA_API_URL
+from langchain_core.embeddings import Embeddings
+from config.organizations import get_org_config, ORGANIZATIONS
+from try_catch_decorator_new import handle_exceptions
+
+JINA_EMBEDDING_MODEL = 'jina-embeddings-v2-base-en'
+LOCAL_EMBEDDING_MODEL = os.getenv('LOCAL_EMBEDDING_MODEL', 'BAAI/bge-small-en-v1.5')
+LOCAL_EMBEDDING_REVISION = os.getenv('LOCAL_EMBEDDING_REVISION')
+LOCAL_EMBEDDING_RUNTIME = os.getenv('LOCAL_EMBEDDING_RUNTIME', 'torch')
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', '32'))
+LOCAL_EMBEDDING_THREADS = int(os.getenv('LOCAL_EMBEDDING_THREADS', '4'))
+JINA_TIMEOUT_SECONDS = float(os.getenv('JINA_TIMEOUT_SECONDS', '30'))
+
+
+_aiohttp_sessions = {}
+
+
+async def _get_aiohttp_session():
+    """Returns the running loop's session; aiohttp sessions cannot be shared across loops."""
+    loop = asyncio.get_running_loop()
+    session = _aiohttp_sessions.get(loop)
+    if session is None or session.closed:
+        _forget_closed_loops()
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=JINA_TIMEOUT_SECONDS))
+        _aiohttp_sessions[loop] = session
+    return session
+
+
+def _forget_closed_loops():
+    for loop in [loop for loop in list(_aiohttp_sessions) if loop.is_closed()]:
+        _aiohttp_sessions.pop(loop, None)
+
+
+async def close_embedding_sessions():
+    """Closes the running loop's aiohttp session; call it when the loop shuts down."""
+    session = _aiohttp_sessions.pop(asyncio.get_running_loop(), None)
+    _forget_closed_loops()
+    if session is not None and not session.closed:
+        await session.close()
+
+
+class AsyncJinaEmbeddings(JinaEmbeddings):
+    """JinaEmbeddings with a native aiohttp path, so async callers do not occupy executor threads."""
+
+    async def _aembed(self, input):
+        session = await _get_aiohttp_session()
+        async with session.post(
+            JINA_API_URL,
+            json={"input": input, "model": self.model_name},
+            headers=dict(self.session.headers)
+        ) as resp:
+            resp.raise_for_status()
+            payload = await resp.json()
+        if "data" not in payload:
+            raise RuntimeError(payload["detail"])
+        embeddings = sorted(payload["data"], key=lambda e: e["index"])
+        return [result["embedding"] for result in embeddings]
+
+    async def aembed_documents(self, texts):
+        return await self._aembed(texts)
+
+    async def aembed_query(self, text):
+        return (await self._aembed([text]))[0]
+
+
+class LocalEmbeddings(Embeddings):
+    """A sentence-transformers model on CPU, loaded on first use.
+
+    Inputs are encoded in batches of `batch_size`; multi-batch requests and all async calls run
+    on a shared thread pool so they neither serialize nor block the event loop.
+    """
+
+    def __init__(self, model_name, revision=None, runtime='torch', batch_size=32, threads=4):
+        self.model_name = model_name
+        self.revision = revision
+        self.runtime = runtime
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='embed')
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise ValueError("sentence-transformers is required for the local embedding backend")
+                options = {"device": "cpu", "revision": self.revision}
+                if self.runtime != 'torch':
+                    options["backend"] = self.runtime
+                self._model = SentenceTransformer(self.model_name, **options)
+        return self._model
+
+    def _encode(self, texts):
+        vectors = self.load().encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def _batches(self, texts):
+        return [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+    def embed_documents(self, texts):
+        batches = self._batches(texts)
+        if len(batches) <= 1:
+            return self._encode(texts) if texts else []
+        return [vector for batch in self._executor.map(self._encode, batches) for vector in batch]
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+    async def aembed_documents(self, texts):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._encode, batch) for batch in self._batches(texts)
+        ))
+        return [vector for batch in results for vector in batch]
+
+    async def aembed_query(self, text):
+        loop = asyncio.get_running_loop()
+        return (await loop.run_in_executor(self._executor, self._encode, [text]))[0]
+
+
+class EmbeddingBackend:
+    """An embeddings client plus the model-version tag stored with every index it produces.
+
+    Vectors from different model versions are not comparable, so the tag decides whether a
+    stored index or cached chunk vector can be reused.
+    """
+
+    def __init__(self, name, embeddings, model_version, warm_up=None):
+        self.name = name
+        self.embeddings = embeddings
+        self.model_version = model_version
+        self._warm_up = warm_up
+
+    def warm_up(self):
+        if self._warm_up:
+            self._warm_up()
+
+
+def create_jina_backend(model=None):
+    api_key = os.getenv('JINA_API_KEY')
+    if not api_key:
+        raise ValueError("JINA_API_KEY not found in environment variables")
+    model = model or JINA_EMBEDDING_MODEL
+    return EmbeddingBackend('jina', AsyncJinaEmbeddings(api_key=api_key, model_name=model), model)
+
+
+def create_local_backend(model=None):
+    model = model or LOCAL_EMBEDDING_MODEL
+    embeddings = LocalEmbeddings(model, LOCAL_EMBEDDING_REVISION, LOCAL_EMBEDDING_RUNTIME,
+                                 LOCAL_EMBEDDING_BATCH_SIZE, LOCAL_EMBEDDING_THREADS)
+    version = f"{model}@{LOCAL_EMBEDDING_REVISION}" if LOCAL_EMBEDDING_REVISION else model
+    return EmbeddingBackend('local', embeddings, version, warm_up=lambda: embeddings.embed_query("warm up"))
+
+
+EMBEDDING_BACKENDS = {
+    'jina': create_jina_backend,
+    'local': create_local_backend
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+@handle_exceptions
+def register_embedding_backend(name, factory):
+    """Makes `factory(model=None) -> EmbeddingBackend` selectable as an org's embedding backend."""
+    EMBEDDING_BACKENDS[name] = factory
+    with _backends_lock:
+        for key in [key for key in _backends if key[0] == name]:
+            del _backends[key]
+
+
+@handle_exceptions
+def get_embedding_backend(organization=None):
+    """Returns the org's configured backend; orgs with the same backend and model share one instance."""
+    config = get_org_config(organization).get('embedding', {})
+    key = (config.get('backend') or 'jina', config.get('model'))
+    backend = _backends.get(key)
+    if backend is not None:
+        return backend
+
+    with _backends_lock:
+        if key not in _backends:
+            if key[0] not in EMBEDDING_BACKENDS:
+                raise ValueError(f"Unknown embedding backend: {key[0]}")
+            _backends[key] = EMBEDDING_BACKENDS[key[0]](key[1])
+        return _backends[key]
+
+
+@handle_exceptions
+def warm_up_embedding_backends():
+    """Loads every configured backend once, so the first query does not pay for model loading."""
+    warmed = set()
+    for org_name in ORGANIZATIONS.keys():
+        try:
+            backend = get_embedding_backend(org_name)
+            if id(backend) not in warmed:
+                backend.warm_up()
+                warmed.add(id(backend))
+        except Exception as e:
+            print(f"Embedding backend warm-up failed for {org_name}: {str(e)}", flush=True)
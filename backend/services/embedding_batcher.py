@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from services.embedding_backends import get_embedding_backend
+from services.metrics import metrics
+from try_catch_decorator_new import handle_exceptions
+
+QUERY_BATCHING_ENABLED = os.getenv('QUERY_BATCHING_ENABLED', 'true').lower() == 'true'
+QUERY_BATCH_MAX_SIZE = int(os.getenv('QUERY_BATCH_MAX_SIZE', '32'))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', '3'))
+QUERY_BATCH_WORKERS = int(os.getenv('QUERY_BATCH_WORKERS', '4'))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+metrics.describe("query_embedding_batch_size", "Query embeddings sent per coalesced embed_documents request.")
+metrics.describe("query_embedding_batch_wait_seconds", "Time a query waited for its batch to be sent.")
+
+
+class QueryEmbeddingBatcher:
+    """Coalesces concurrent single-query embedding calls into one embed_documents request.
+
+    A collector thread holds the first pending query for at most `max_wait` seconds (less if
+    `max_batch_size` queries arrive first), then hands the batch to a pool of `workers` so the
+    next batch can be collected while this one is in flight. When every worker is busy the
+    collector waits for a free one, so batches grow with load instead of queueing up.
+    Duplicate texts are embedded once.
+    """
+
+    def __init__(self, embeddings, name, max_batch_size=32, max_wait=0.003, workers=4):
+        self.embeddings = embeddings
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embed-batch')
+        self._slots = threading.Semaphore(workers)
+        self._collector = None
+
+    def submit(self, text):
+        future = Future()
+        with self._condition:
+            self._pending.append((text, future, time.perf_counter()))
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name=f'embed-batch-{self.name}',
+                                                   daemon=True)
+                self._collector.start()
+            self._condition.notify()
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        while True:
+            self._slots.acquire()
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        sent_at = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        metrics.observe("query_embedding_batch_size", len(texts), buckets=BATCH_SIZE_BUCKETS, model=self.name)
+        for _, _, enqueued_at in batch:
+            metrics.observe("query_embedding_batch_wait_seconds", sent_at - enqueued_at, model=self.name)
+        try:
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+@handle_exceptions
+def get_query_batcher(organization=None):
+    """Returns the batcher for the org's embedding backend, or None when batching is disabled."""
+    if not QUERY_BATCHING_ENABLED:
+        return None
+    backend = get_embedding_backend(organization)
+    entry = _batchers.get(id(backend))
+    if entry is not None and entry[0] is backend:
+        return entry[1]
+
+    with _batchers_lock:
+        entry = _batchers.get(id(backend))
+        if entry is None or entry[0] is not backend:
+            batcher = QueryEmbeddingBatcher(backend.embeddings, backend.model_version, QUERY_BATCH_MAX_SIZE,
+                                            QUERY_BATCH_MAX_WAIT_MS / 1000, QUERY_BATCH_WORKERS)
+            entry = _batchers[id(backend)] = (backend, batcher)
+        return entry[1]
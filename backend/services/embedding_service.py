@@ -1,36 +1,164 @@
-import pickle
-from langchain_community.embeddings import JinaEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.docstore.document import Document
 from try_catch_decorator_new import handle_exceptions
 from datetime import datetime
 from gridfs import GridFS
-import io
-from database import mongo
+from database import mongo, EMBEDDINGS_FILE_KIND, EMBEDDINGS_FILES_QUERY
+from bson.binary import Binary
+from pymongo import UpdateOne
+import numpy as np
+import asyncio
+import hashlib
 import os
-from config.organizations import ORGANIZATIONS
+import re
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from config.organizations import ORGANIZATIONS, DEFAULT_ORG
+from services.lru_cache import LRUCache
+from services.response_cache import ResponseCache
+from services.index_format import (serialize_user_index, load_user_index_buffer, load_user_index_file,
+                                   spill_user_index, is_index_blob)
+from services.org_index import shared_index_enabled, get_org_index, get_org_index_stats
+from services.embedding_stats import record_embeddings_change, read_embedding_stats
+from services.metrics import span
+from services.embedding_backends import get_embedding_backend, JINA_EMBEDDING_MODEL
+from services.embedding_batcher import get_query_batcher
+from services.chunking import iter_chunk_documents
+
+# The model every index was built with before backends became configurable per org.
+EMBEDDING_MODEL = JINA_EMBEDDING_MODEL
+INDEX_CACHE_MAX_BYTES = int(os.getenv('INDEX_CACHE_MAX_MB', '256')) * 1024 * 1024
+INDEX_SPILL_DIR = os.getenv('INDEX_SPILL_DIR')
+# Temp files older than this belong to a writer that died mid-spill.
+SPILL_TEMP_MAX_AGE = 3600
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '10000'))
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '600'))
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_THRESHOLD = float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95'))
+RESPONSE_CACHE_USERS = int(os.getenv('RESPONSE_CACHE_USERS', '1000'))
+RESPONSE_CACHE_PER_USER = int(os.getenv('RESPONSE_CACHE_PER_USER', '50'))
+
+
+def _index_size(entry):
+    file_id, store = entry
+    return store.nbytes
+
+
+def _file_age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _remove_spill_file(key, entry):
+    if INDEX_SPILL_DIR:
+        try:
+            os.remove(_spill_path(entry[0], key[0]))
+        except FileNotFoundError:
+            pass
+
+
+index_cache = LRUCache(max_bytes=INDEX_CACHE_MAX_BYTES, sizeof=_index_size, on_evict=_remove_spill_file)
+retrieval_cache = LRUCache(max_entries=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+response_cache = ResponseCache(RESPONSE_CACHE_USERS, RESPONSE_CACHE_PER_USER, RESPONSE_CACHE_THRESHOLD)
+
+
+def _index_cache_key(username, organization=None):
+    org_key = organization if organization in ORGANIZATIONS else DEFAULT_ORG
+    return (org_key, username)
+
+
+@handle_exceptions
+def invalidate_user_index(username, organization=None):
+    key = _index_cache_key(username, organization)
+    retrieval_cache.invalidate_where(lambda cached_key: cached_key[:2] == key)
+    response_cache.invalidate_where(lambda cached_key: cached_key == key)
+    entry = index_cache.pop(key)
+    if entry:
+        _remove_spill_file(key, entry)
+
 
 @handle_exceptions
-def embedding_function():
-    api_key = os.getenv('JINA_API_KEY')
-    if not api_key:
-        raise ValueError("JINA_API_KEY not found in environment variables")
-    embedding_model = JinaEmbeddings(
-        api_key=api_key,
-        model_name='jina-embeddings-v2-base-en'
-    )
-    return embedding_model
+def invalidate_organization_indexes(organization=None):
+    org_key, _ = _index_cache_key(None, organization)
+    retrieval_cache.invalidate_where(lambda key: key[0] == org_key)
+    response_cache.invalidate_where(lambda key: key[0] == org_key)
+    return index_cache.invalidate_where(lambda key: key[0] == org_key)
+
+
+@handle_exceptions
+def get_index_cache_stats():
+    stats = index_cache.stats()
+    stats["org_indexes"] = get_org_index_stats()
+    stats["retrieval_cache"] = retrieval_cache.stats()
+    stats["response_cache"] = response_cache.stats()
+    return stats, 200
+
+
+@handle_exceptions
+def embedding_function(organization=None):
+    return get_embedding_backend(organization).embeddings
+
+
+@handle_exceptions
+def embedding_model_version(organization=None):
+    """The model-version tag stored with the org's indexes and cached chunk vectors."""
+    return get_embedding_backend(organization).model_version
 
 
 @handle_exceptions
 def chunk_text(text: str) -> list:
-    """Split text into chunks by double newlines and return non-empty chunks."""
-    chunks = [chunk.strip() for chunk in text.split('\n\n')]
-    chunks = [chunk for chunk in chunks if chunk]
-    print("len(chunks)", len(chunks))
-    for i, chunk in enumerate(chunks):
-        print(f"Chunk {i}: {chunk[:100]}...")
-    return chunks
+    """Split text into size-bounded chunks; see services.chunking for the limits."""
+    return [document.page_content for document in iter_chunk_documents(text)]
+
+
+def _chunk_cache_id(model, chunk):
+    return f"{model}:{hashlib.sha256(chunk.encode('utf-8')).hexdigest()}"
+
+
+@handle_exceptions
+def embed_chunks(chunks, organization=None):
+    """Embeds chunks, reusing vectors stored in `embedding_cache` and only sending unseen text to the model."""
+    cache = mongo.get_db(organization).embedding_cache
+    model_version = embedding_model_version(organization)
+    cache_ids = [_chunk_cache_id(model_version, chunk) for chunk in chunks]
+
+    cached = {
+        doc["_id"]: np.frombuffer(doc["vector"], dtype="float32").tolist()
+        for doc in cache.find({"_id": {"$in": list(set(cache_ids))}})
+    }
+
+    missing = {}
+    for cache_id, chunk in zip(cache_ids, chunks):
+        if cache_id not in cached:
+            missing.setdefault(cache_id, chunk)
+
+    if missing:
+        embedding_model = embedding_function(organization)
+        texts = list(missing.values())
+        computed = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            with span("chunk_embedding", organization):
+                computed.extend(embedding_model.embed_documents(texts[start:start + EMBEDDING_BATCH_SIZE]))
+        with span("mongo_write", organization):
+            cache.bulk_write([
+                UpdateOne(
+                    {"_id": cache_id},
+                    {"$setOnInsert": {
+                        "model": model_version,
+                        "vector": Binary(np.asarray(vector, dtype="float32").tobytes()),
+                        "created_at": datetime.utcnow()
+                    }},
+                    upsert=True
+                )
+                for cache_id, vector in zip(missing.keys(), computed)
+            ], ordered=False)
+        cached.update(zip(missing.keys(), computed))
+
+    vectors = [cached[cache_id] for cache_id in cache_ids]
+    stats = {"chunks_reused": len(chunks) - len(missing), "chunks_computed": len(missing)}
+    return vectors, stats
 
 
 @handle_exceptions
@@ -46,17 +174,74 @@ def save_user_embeddings(username, text, organization=None):
     if not chunks:
         raise ValueError("No valid text chunks found")
 
-    documents = [Document(page_content=chunk) for chunk in chunks]
-    embedding_model = embedding_function()
-    db = FAISS.from_documents(documents, embedding_model)
+    vectors, stats = embed_chunks(chunks, organization)
+    print(f"Embeddings for {username}: {stats['chunks_reused']} reused, "
+          f"{stats['chunks_computed']} computed", flush=True)
 
-    buffer = io.BytesIO()
-    pickle.dump(db, buffer)
+    store_user_index(username, vectors, chunks, organization)
+
+    return {"message": "Embeddings saved successfully", **stats}, 201
+
+
+@handle_exceptions
+def store_user_index(username, vectors, chunks, organization=None):
+    """Persists already-computed chunk vectors as the user's index (GridFS file or shared org index)."""
+    if shared_index_enabled(organization):
+        with span("mongo_write", organization):
+            get_org_index(organization).replace_user(username, vectors, chunks,
+                                                     embedding_model_version(organization))
+        invalidate_user_index(username, organization)
+        return
+
+    model_version = embedding_model_version(organization)
+    data = serialize_user_index(vectors, chunks, model_version)
 
     fs = GridFS(mongo.get_db(organization))
-    fs.put(buffer.getvalue(), filename=f"{username}_embeddings")
+    with span("mongo_write", organization):
+        replaced = list(fs.find({"filename": f"{username}_embeddings"}))
+        fs.put(data, filename=f"{username}_embeddings",
+               metadata={"kind": EMBEDDINGS_FILE_KIND, "username": username, "model": model_version})
+        for old_file in replaced:
+            fs.delete(old_file._id)
+    record_embeddings_change(organization, 1 - len(replaced),
+                             len(data) - sum(old_file.length for old_file in replaced))
+    invalidate_user_index(username, organization)
 
-    return {"message": "Embeddings saved successfully"}, 201
+
+@handle_exceptions
+def backfill_shared_index(organization=None):
+    """Moves an org's per-user GridFS indexes into its shared index, for orgs switched to
+    <ORG>_SHARED_INDEX after users were created. Returns (moved, skipped).
+
+    Users that already have shared vectors keep them and only lose the stale file; files built
+    with another model or still in the legacy format are left for a re-save or migration.
+    """
+    db = mongo.get_db(organization)
+    fs = GridFS(db)
+    org_index = get_org_index(organization)
+    model_version = embedding_model_version(organization)
+    moved = 0
+    skipped = 0
+    for grid_file in list(fs.find(EMBEDDINGS_FILES_QUERY)):
+        username = grid_file.filename[:-len("_embeddings")]
+        if not db.chunk_vectors.find_one({"username": username}, {"_id": 1}):
+            data = grid_file.read()
+            if not is_index_blob(data):
+                print(f"{grid_file.filename} uses the legacy pickle format; run migrate_embeddings.py", flush=True)
+                skipped += 1
+                continue
+            stored_data = load_user_index_buffer(data)
+            if stored_data.model != model_version:
+                print(f"Embeddings for {username} were built with {stored_data.model}, not {model_version}; "
+                      f"modify the user's text to re-embed", flush=True)
+                skipped += 1
+                continue
+            org_index.replace_user(username, stored_data.vectors(), stored_data.chunks(), stored_data.model)
+            moved += 1
+        fs.delete(grid_file._id)
+        record_embeddings_change(organization, -1, -grid_file.length)
+        invalidate_user_index(username, organization)
+    return moved, skipped
 
 
 @handle_exceptions
@@ -65,61 +250,283 @@ def modify_user_embeddings(username, new_text, organization=None):
     if not new_text:
         raise ValueError("New text is required")
     db = mongo.get_db(organization)
-    fs = GridFS(db)
-    existing_file = fs.find_one({"filename": f"{username}_embeddings"})
-
-    fs.delete(existing_file._id)
     modified_at = datetime.utcnow()
-    db.users.update_one(
-        {"name": username},
-        {
-            "$set": {"created_at": modified_at},
-            "$inc": {"modifications": 1}
-        }
-    )
+    with span("mongo_write", organization):
+        db.users.update_one(
+            {"name": username},
+            {
+                "$set": {"created_at": modified_at},
+                "$inc": {"modifications": 1}
+            }
+        )
     response, status_code = save_user_embeddings(username, new_text, organization)
     return response, status_code
 
 
+def _spill_path(file_id, organization=None):
+    org_key, _ = _index_cache_key(None, organization)
+    return os.path.join(INDEX_SPILL_DIR, org_key, f"{file_id}.idx")
+
+
+@handle_exceptions
+def read_user_index(file_data, organization=None):
+    """Loads a GridFS embeddings file, memory-mapping it from INDEX_SPILL_DIR when that is configured."""
+    path = _spill_path(file_data._id, organization) if INDEX_SPILL_DIR else None
+    if path and os.path.exists(path):
+        try:
+            return load_user_index_file(path)
+        except FileNotFoundError:
+            # Another worker evicted it between the check and the open; spill it again.
+            pass
+
+    data = file_data.read()
+    if not is_index_blob(data):
+        raise ValueError(f"{file_data.filename} uses the legacy pickle format; run migrate_embeddings.py")
+    if path:
+        spill_user_index(path, data)
+        return load_user_index_file(path)
+    return load_user_index_buffer(data)
+
+
 @handle_exceptions
-def get_relevant_chunks(username: str, query: str, organization=None, k: int = 3) -> list:
+def sweep_spill_files(organization=None):
+    """Deletes spilled index files whose GridFS file no longer exists, e.g. left by a crashed or
+    restarted worker, along with abandoned temp files. Returns how many files were removed."""
+    if not INDEX_SPILL_DIR:
+        return 0
+    org_dir = os.path.dirname(_spill_path("", organization))
+    try:
+        names = os.listdir(org_dir)
+    except FileNotFoundError:
+        return 0
+
+    paths_by_id = {}
+    stale = []
+    for name in names:
+        path = os.path.join(org_dir, name)
+        stem, extension = os.path.splitext(name)
+        if extension == ".idx":
+            try:
+                paths_by_id[ObjectId(stem)] = path
+            except InvalidId:
+                pass
+        elif extension == ".tmp" and _file_age(path) > SPILL_TEMP_MAX_AGE:
+            stale.append(path)
+
+    if paths_by_id:
+        live_ids = {doc["_id"] for doc in mongo.get_db(organization).fs.files.find(
+            {"_id": {"$in": list(paths_by_id)}}, {"_id": 1})}
+        stale.extend(path for file_id, path in paths_by_id.items() if file_id not in live_ids)
+
+    removed = 0
+    for path in stale:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _load_user_index(username, organization=None):
+    """Returns (GridFS file id, index); the index is None when the file was built with another model."""
     fs = GridFS(mongo.get_db(organization))
-    file_data = fs.find_one({"filename": f"{username}_embeddings"})
+    with span("gridfs_fetch", organization):
+        file_data = fs.find_one({"filename": f"{username}_embeddings"})
 
     if not file_data:
+        invalidate_user_index(username, organization)
+        return None, None
+
+    key = _index_cache_key(username, organization)
+    cached = index_cache.get(key)
+    if cached and cached[0] == file_data._id:
+        return file_data._id, cached[1]
+
+    with span("index_load", organization):
+        stored_data = read_user_index(file_data, organization)
+    if stored_data.model != embedding_model_version(organization):
+        print(f"Embeddings for {username} were built with {stored_data.model}, not "
+              f"{embedding_model_version(organization)}; modify the user's text to re-embed", flush=True)
+        return file_data._id, None
+    index_cache.set(key, (file_data._id, stored_data))
+    return file_data._id, stored_data
+
+
+@handle_exceptions
+def load_user_index(username, organization=None):
+    """Returns the user's index, served from the process-wide cache while the GridFS file is unchanged."""
+    return _load_user_index(username, organization)[1]
+
+
+@handle_exceptions
+def prefetch_user_index(username, organization=None):
+    """Loads the user's index into the cache ahead of retrieval and returns its embeddings version."""
+    if shared_index_enabled(organization):
+        return get_org_index(organization).user_version(username)
+    file_id, _ = _load_user_index(username, organization)
+    return str(file_id) if file_id else None
+
+
+@handle_exceptions
+def embed_query(query: str, organization=None) -> list:
+    with span("query_embedding", organization):
+        batcher = get_query_batcher(organization)
+        if batcher is not None:
+            return batcher.embed_query(query)
+        return embedding_function(organization).embed_query(query)
+
+
+@handle_exceptions
+async def aembed_query(query: str, organization=None) -> list:
+    with span("query_embedding", organization):
+        batcher = get_query_batcher(organization)
+        if batcher is not None:
+            return await batcher.aembed_query(query)
+        return await embedding_function(organization).aembed_query(query)
+
+
+@handle_exceptions
+def get_embeddings_version(username, organization=None):
+    """Identifies the user's current embeddings; it changes whenever they are saved again."""
+    if shared_index_enabled(organization):
+        return get_org_index(organization).user_version(username)
+    with span("gridfs_fetch", organization):
+        file_data = GridFS(mongo.get_db(organization)).find_one({"filename": f"{username}_embeddings"})
+    return str(file_data._id) if file_data else None
+
+
+@handle_exceptions
+def get_cached_response(username, organization, version, query_embedding):
+    if not RESPONSE_CACHE_ENABLED or version is None:
+        return None
+    return response_cache.lookup(_index_cache_key(username, organization), version, query_embedding)
+
+
+@handle_exceptions
+def cache_response(username, organization, version, query_embedding, response):
+    if RESPONSE_CACHE_ENABLED and query_embedding is not None:
+        response_cache.store(_index_cache_key(username, organization), version, query_embedding, response)
+
+
+@handle_exceptions
+def get_relevant_chunks_batch(username: str, queries: list, organization=None, k: int = 3):
+    """Embeds all queries in one request and searches the user's index, loaded once, for each.
+
+    Returns (chunks per query, query embeddings, embeddings version).
+    """
+    with span("query_embedding", organization):
+        query_embeddings = embedding_function(organization).embed_documents(queries)
+    if shared_index_enabled(organization):
+        org_index = get_org_index(organization)
+        with span("faiss_search", organization):
+            contexts = [org_index.search(username, embedding, k=k) for embedding in query_embeddings]
+        return contexts, query_embeddings, org_index.user_version(username)
+
+    file_id, stored_data = _load_user_index(username, organization)
+    version = str(file_id) if file_id else None
+    if stored_data is None:
+        print(f"No embeddings found for user: {username}")
+        return [[] for _ in queries], query_embeddings, version
+    with span("faiss_search", organization):
+        return [stored_data.search(embedding, k=k) for embedding in query_embeddings], query_embeddings, version
+
+
+@handle_exceptions
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?.! ")
+
+
+def _retrieval_cache_key(username, query, version, organization=None, k=3):
+    # The embeddings version keeps workers from serving chunks another worker has since replaced.
+    org_key, _ = _index_cache_key(username, organization)
+    return (org_key, username, version, normalize_query(query), k)
+
+
+@handle_exceptions
+def search_user_chunks(username: str, query: str, organization=None, k: int = 3, query_embedding=None) -> list:
+    if shared_index_enabled(organization):
+        if query_embedding is None:
+            query_embedding = embed_query(query, organization)
+        with span("faiss_search", organization):
+            return get_org_index(organization).search(username, query_embedding, k=k)
+
+    stored_data = load_user_index(username, organization)
+
+    if stored_data is None:
         print(f"No embeddings found for user: {username}")
         return []
 
-    buffer = io.BytesIO(file_data.read())
-    stored_data = pickle.loads(buffer.getvalue())
-    
-    # Get query embedding
-    embedding_model = embedding_function()
-    query_embedding = embedding_model.embed_query(query)
-    
-    # Use stored index directly
-    results = stored_data.similarity_search_by_vector(query_embedding, k=k)
-    chunks = [doc.page_content for doc in results]
-    return chunks
+    if query_embedding is None:
+        query_embedding = embed_query(query, organization)
+
+    with span("faiss_search", organization):
+        return stored_data.search(query_embedding, k=k)
 
 
 @handle_exceptions
-def get_embedding_statistics(organization=None):
-    """Returns total size and count of embeddings stored in GridFS."""
-    db = mongo.get_db(organization)
-    total_size = 0
-    total_embeddings = 0
+async def asearch_user_chunks(username: str, query: str, organization=None, k: int = 3,
+                              query_embedding=None) -> list:
+    """Async search_user_chunks: Mongo reads and FAISS work run in worker threads while the query embeds."""
+    if shared_index_enabled(organization):
+        if query_embedding is None:
+            query_embedding = await aembed_query(query, organization)
+        org_index = get_org_index(organization)
+        with span("faiss_search", organization):
+            return await asyncio.to_thread(org_index.search, username, query_embedding, k)
 
-    user_count = db.users.count_documents({})
+    index_task = asyncio.ensure_future(asyncio.to_thread(load_user_index, username, organization))
+    if query_embedding is None:
+        query_embedding = await aembed_query(query, organization)
+    stored_data = await index_task
 
-    fs = GridFS(db)
-    for grid_file in fs.find({"filename": {"$regex": "_embeddings$"}}):
-        total_size += grid_file.length
-        total_embeddings += 1
+    if stored_data is None:
+        print(f"No embeddings found for user: {username}")
+        return []
+
+    with span("faiss_search", organization):
+        return stored_data.search(query_embedding, k=k)
+
+
+@handle_exceptions
+def get_relevant_chunks(username: str, query: str, organization=None, k: int = 3, query_embedding=None,
+                        version=None) -> list:
+    """Returns the top-k chunks for a query, skipping embedding and search on a retrieval cache hit.
 
+    Pass the user's embeddings `version` when it is already known to save looking it up.
+    """
+    if version is None:
+        version = get_embeddings_version(username, organization)
+    key = _retrieval_cache_key(username, query, version, organization, k)
+    chunks = retrieval_cache.get(key)
+    if chunks is None:
+        chunks = search_user_chunks(username, query, organization, k, query_embedding)
+        if chunks:
+            retrieval_cache.set(key, chunks)
+    return list(chunks)
+
+
+@handle_exceptions
+async def aget_relevant_chunks(username: str, query: str, organization=None, k: int = 3,
+                               query_embedding=None, version=None) -> list:
+    if version is None:
+        version = await asyncio.to_thread(get_embeddings_version, username, organization)
+    key = _retrieval_cache_key(username, query, version, organization, k)
+    chunks = retrieval_cache.get(key)
+    if chunks is None:
+        chunks = await asearch_user_chunks(username, query, organization, k, query_embedding)
+        if chunks:
+            retrieval_cache.set(key, chunks)
+    return list(chunks)
+
+
+@handle_exceptions
+def get_embedding_statistics(organization=None):
+    """Returns total size and count of stored embeddings from the org's precomputed stats document."""
+    stats = read_embedding_stats(organization)
     return {
-        "total_size_mb": round(total_size / (1024 * 1024), 2),
-        "total_embeddings": user_count
+        "total_size_mb": round(stats["size_bytes"] / (1024 * 1024), 2),
+        "total_embeddings": stats["count"]
     }, 200
 
 
@@ -0,0 +1,53 @@
+from datetime import datetime
+from pymongo import ReturnDocument
+from database import mongo, EMBEDDINGS_FILES_QUERY
+from try_catch_decorator_new import handle_exceptions
+
+STATS_ID = "embeddings"
+
+
+@handle_exceptions
+def record_embeddings_change(organization=None, count=0, size_bytes=0):
+    """Applies a delta to the org's embedding stats document.
+
+    Deltas are only applied to an existing document; a missing one is rebuilt by
+    reconcile_embedding_stats on the next read, so a partial upsert never masks older data.
+    """
+    if not count and not size_bytes:
+        return
+    mongo.get_db(organization).stats.update_one(
+        {"_id": STATS_ID},
+        {"$inc": {"count": count, "size_bytes": size_bytes}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+@handle_exceptions
+def reconcile_embedding_stats(organization=None):
+    """Rebuilds the org's stats document from GridFS embedding files and shared-index chunk vectors."""
+    db = mongo.get_db(organization)
+    count = 0
+    size_bytes = 0
+    for grid_file in db.fs.files.find(EMBEDDINGS_FILES_QUERY, {"length": 1}):
+        count += 1
+        size_bytes += grid_file["length"]
+
+    users = set()
+    for doc in db.chunk_vectors.find({}, {"username": 1, "nbytes": 1, "vector": 1, "text": 1}):
+        users.add(doc["username"])
+        size_bytes += doc.get("nbytes") or len(doc["vector"]) + len(doc["text"].encode("utf-8"))
+    count += len(users)
+
+    return db.stats.find_one_and_update(
+        {"_id": STATS_ID},
+        {"$set": {"count": count, "size_bytes": size_bytes, "updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+@handle_exceptions
+def read_embedding_stats(organization=None):
+    stats = mongo.get_db(organization).stats.find_one({"_id": STATS_ID})
+    if stats is None:
+        stats = reconcile_embedding_stats(organization)
+    return stats
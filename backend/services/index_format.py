@@ -0,0 +1,138 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import faiss
+import numpy as np
+
+# Layout: preamble | JSON header | faiss index bytes | (count + 1) uint64 offsets | utf-8 chunk texts
+INDEX_MAGIC = b"RAGIDX\x00\x00"
+INDEX_FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sHI")
+
+
+class StoredIndex:
+    """A FAISS index plus its chunk-text table, read directly from a serialized buffer."""
+
+    def __init__(self, index, header, offsets, texts, source=None):
+        self.index = index
+        self.header = header
+        self.model = header.get("model")
+        self.version = header.get("version")
+        self._offsets = offsets
+        self._texts = texts
+        self._source = source
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def nbytes(self):
+        """Heap memory this index keeps alive; memory-mapped chunk texts live in the page cache instead."""
+        texts = 0 if self._source is not None else len(self._texts)
+        return self.index.ntotal * self.index.d * 4 + len(self._offsets) * 8 + texts
+
+    def chunk(self, position):
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def chunks(self):
+        return [self.chunk(i) for i in range(len(self._offsets) - 1)]
+
+    def vectors(self):
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def search(self, query_embedding, k=3):
+        if not self.index.ntotal:
+            return []
+        query = np.asarray([query_embedding], dtype="float32")
+        _, ids = self.index.search(query, min(k, self.index.ntotal))
+        return [self.chunk(int(i)) for i in ids[0] if i != -1]
+
+
+def is_index_blob(data):
+    return bytes(data[:len(INDEX_MAGIC)]) == INDEX_MAGIC
+
+
+def serialize_user_index(vectors, chunks, model):
+    """Builds a flat L2 index over the vectors and returns the versioned blob."""
+    vectors = np.asarray(vectors, dtype="float32")
+    if vectors.ndim != 2 or len(vectors) != len(chunks):
+        raise ValueError("Vectors and chunks must have matching lengths")
+
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    index_bytes = faiss.serialize_index(index).tobytes()
+
+    encoded = [chunk.encode("utf-8") for chunk in chunks]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+
+    header = json.dumps({
+        "version": INDEX_FORMAT_VERSION,
+        "model": model,
+        "dim": int(vectors.shape[1]),
+        "count": len(chunks),
+        "index_size": len(index_bytes)
+    }).encode("utf-8")
+
+    return b"".join([
+        _PREAMBLE.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(header)),
+        header,
+        index_bytes,
+        offsets.tobytes(),
+        *encoded
+    ])
+
+
+def load_user_index_buffer(buffer, source=None):
+    """Reads a blob produced by serialize_user_index from bytes, a memoryview or an mmap.
+
+    With a `source` mapping the offsets and chunk texts stay views into it; otherwise they are
+    copied out, so the raw blob (including the FAISS bytes) can be freed once this returns.
+    """
+    view = memoryview(buffer)
+    magic, version, header_len = _PREAMBLE.unpack_from(view, 0)
+    if magic != INDEX_MAGIC:
+        raise ValueError("Not a versioned embeddings index")
+    if version > INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported embeddings index version: {version}")
+
+    position = _PREAMBLE.size
+    header = json.loads(bytes(view[position:position + header_len]))
+    position += header_len
+
+    index_data = np.frombuffer(view, dtype="uint8", count=header["index_size"], offset=position)
+    index = faiss.deserialize_index(index_data)
+    position += header["index_size"]
+
+    offsets = np.frombuffer(view, dtype="<u8", count=header["count"] + 1, offset=position)
+    position += offsets.nbytes
+    texts = view[position:]
+    if source is None:
+        offsets, texts = offsets.copy(), bytes(texts)
+
+    return StoredIndex(index, header, offsets, texts, source)
+
+
+def load_user_index_file(path):
+    """Memory-maps a spilled index file; chunk texts are paged in only when a result needs them."""
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return load_user_index_buffer(mapped, source=mapped)
+
+
+def spill_user_index(path, data):
+    """Writes the blob to the spill directory atomically so concurrent readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return path
@@ -0,0 +1,150 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from database import mongo
+from try_catch_decorator_new import handle_exceptions, CustomException
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_BACKOFF_SECONDS = float(os.getenv('JOB_BACKOFF_SECONDS', '10'))
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '1800'))
+
+
+class JobQueue:
+    """Runs background jobs on a local worker pool, with job records persisted in each org's `jobs` collection.
+
+    A job is claimed with an atomic queued -> running update, so a record re-submitted by another
+    worker or by recovery after a restart never runs twice at once. Failures are retried with
+    exponential backoff until max_attempts.
+    """
+
+    def __init__(self, workers=4, max_attempts=3, backoff_seconds=10.0):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.handlers = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+        return handler
+
+    def enqueue(self, job_type, organization, payload, max_attempts=None):
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = datetime.utcnow()
+        result = mongo.get_db(organization).jobs.insert_one({
+            "type": job_type,
+            "organization": organization,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "next_run_at": now
+        })
+        self.submit(organization, result.inserted_id)
+        return str(result.inserted_id)
+
+    def submit(self, organization, job_id, delay=0):
+        if delay > 0:
+            timer = threading.Timer(delay, self.submit, args=(organization, job_id))
+            timer.daemon = True
+            timer.start()
+            return
+        self._executor.submit(self._run, organization, job_id)
+
+    def recover(self, organization):
+        """Re-submits an org's queued jobs and jobs left running past JOB_STALE_SECONDS, e.g. after a restart."""
+        recovered = 0
+        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        jobs = mongo.get_db(organization).jobs
+        jobs.update_many(
+            {"status": "running", "updated_at": {"$lt": stale_before}},
+            {"$set": {"status": "queued", "updated_at": datetime.utcnow()}}
+        )
+        for job in jobs.find({"status": "queued"}, {"_id": 1, "next_run_at": 1}):
+            delay = (job["next_run_at"] - datetime.utcnow()).total_seconds()
+            self.submit(organization, job["_id"], delay)
+            recovered += 1
+        return recovered
+
+    def _run(self, organization, job_id):
+        jobs = mongo.get_db(organization).jobs
+        job = jobs.find_one_and_update(
+            {"_id": job_id, "status": "queued"},
+            {"$set": {"status": "running", "updated_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+
+        try:
+            result = self.handlers[job["type"]](organization=organization, **job["payload"])
+            jobs.update_one({"_id": job_id}, {"$set": {
+                "status": "succeeded",
+                "result": result,
+                "error": None,
+                "updated_at": datetime.utcnow()
+            }})
+        except Exception as e:
+            print(f"Job {job_id} ({job['type']}) failed on attempt {job['attempts']}: {str(e)}", flush=True)
+            traceback.print_exc()
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.backoff_seconds * 2 ** (job["attempts"] - 1)
+                jobs.update_one({"_id": job_id}, {"$set": {
+                    "status": "queued",
+                    "error": str(e),
+                    "updated_at": datetime.utcnow(),
+                    "next_run_at": datetime.utcnow() + timedelta(seconds=delay)
+                }})
+                self.submit(organization, job_id, delay)
+            else:
+                jobs.update_one({"_id": job_id}, {"$set": {
+                    "status": "failed",
+                    "error": str(e),
+                    "updated_at": datetime.utcnow()
+                }})
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_BACKOFF_SECONDS)
+
+
+def _serialize_job(job):
+    return {
+        "job_id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat()
+    }
+
+
+@handle_exceptions
+def get_job(job_id, organization=None):
+    try:
+        object_id = ObjectId(job_id)
+    except InvalidId:
+        raise CustomException("Invalid job id")
+    job = mongo.get_db(organization).jobs.find_one({"_id": object_id})
+    if not job:
+        raise CustomException("Job not found")
+    return _serialize_job(job), 200
+
+
+@handle_exceptions
+def list_jobs(organization=None, status=None, limit=50):
+    query = {"status": status} if status else {}
+    jobs = mongo.get_db(organization).jobs.find(query).sort("created_at", -1).limit(limit)
+    return {"jobs": [_serialize_job(job) for job in jobs]}, 200
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or total size, with optional TTL.
+
+    on_evict(key, value), when given, runs outside the lock for every entry that leaves the cache,
+    whether evicted, expired, replaced, popped or invalidated.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._dropped = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                value = default
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        self._notify()
+        return value
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            stored = self.max_bytes is None or size <= self.max_bytes
+            if stored:
+                self._entries[key] = (value, size, expires_at)
+                self._total_bytes += size
+                self._evict()
+        self._notify()
+        return stored
+
+    def pop(self, key):
+        """Removes and returns the value; on_evict is not called since the caller now owns it."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            value, size, _ = self._entries.pop(key)
+            self._total_bytes -= size
+            return value
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose key matches the predicate and returns how many were dropped."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        self._notify()
+        return len(keys)
+
+    def invalidate_items_where(self, predicate):
+        """Like invalidate_where, but the predicate receives (key, value)."""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if predicate(key, entry[0])]
+            for key in keys:
+                self._remove(key)
+        self._notify()
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._total_bytes = 0
+        self._notify()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        value, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        if self.on_evict is not None:
+            self._dropped.append((key, value))
+        return value
+
+    def _notify(self):
+        if not self._dropped:
+            return
+        with self._lock:
+            dropped, self._dropped = self._dropped, []
+        for key, value in dropped:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"Cache eviction callback failed for {key}: {str(e)}", flush=True)
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config.organizations import ORGANIZATIONS, DEFAULT_ORG
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_node = ContextVar('metrics_node', default='')
+_request_trace = ContextVar('metrics_trace', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Process-wide histograms and counters keyed by metric name and label values."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def histogram_summary(self, name):
+        """Returns {labels: {"count", "sum"}} for one histogram, for JSON reports."""
+        with self._lock:
+            return {
+                labels: {"count": histogram.count, "sum": histogram.sum}
+                for (metric, labels), histogram in self._histograms.items() if metric == name
+            }
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            counters = sorted(self._counters.items(), key=lambda item: item[0])
+            lines = []
+            seen = set()
+            for (name, labels), histogram in histograms:
+                if name not in seen:
+                    seen.add(name)
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {total}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in counters:
+                if name not in seen:
+                    seen.add(name)
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe("pipeline_stage_seconds", "Duration of chat pipeline stages by organization and graph node.")
+metrics.describe("service_call_seconds", "Duration of every handle_exceptions-wrapped service function.")
+metrics.describe("service_call_errors_total", "Exceptions raised by handle_exceptions-wrapped service functions.")
+metrics.describe("http_request_seconds", "HTTP request duration by route, method and status.")
+
+
+def org_label(organization):
+    """Bounds label cardinality: unknown organizations resolve to the default org, like get_db does."""
+    return organization if organization in ORGANIZATIONS else DEFAULT_ORG
+
+
+def record_stage(stage, seconds, organization=None, node=None):
+    metrics.observe("pipeline_stage_seconds", seconds,
+                    stage=stage, organization=org_label(organization), node=node or _current_node.get())
+    trace = _request_trace.get()
+    if trace is not None:
+        total, count = trace.get(stage, (0.0, 0))
+        trace[stage] = (total + seconds, count + 1)
+
+
+@contextmanager
+def span(stage, organization=None, node=None):
+    """Times a pipeline stage, tagged with the org and the graph node it runs under (or `node`)."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, organization, node)
+
+
+@contextmanager
+def node_span(node, organization=None):
+    """Marks the enclosed code as running in a graph node and times the node itself."""
+    token = _current_node.set(node)
+    try:
+        with span(f"node:{node}", organization):
+            yield
+    finally:
+        _current_node.reset(token)
+
+
+def record_call(function, seconds, organization=None, failed=False):
+    if not METRICS_ENABLED:
+        return
+    metrics.observe("service_call_seconds", seconds, function=function, organization=org_label(organization))
+    if failed:
+        metrics.increment("service_call_errors_total", function=function)
+
+
+def start_trace():
+    """Starts collecting stage timings for the current request; returns a token for end_trace."""
+    return _request_trace.set({})
+
+
+def end_trace(token):
+    """Stops collecting and returns {stage: (seconds, count)} for the request."""
+    trace = _request_trace.get() or {}
+    _request_trace.reset(token)
+    return trace
+
+
+def server_timing(trace):
+    """Formats a request trace as a Server-Timing header value."""
+    return ", ".join(
+        f'{stage.replace(":", "-")};dur={round(seconds * 1000, 2)};desc="{count}x"'
+        for stage, (seconds, count) in trace.items()
+    )
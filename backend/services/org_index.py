@@ -0,0 +1,323 @@
+import os
+import threading
+import time
+from datetime import datetime
+from contextlib import contextmanager
+import faiss
+import numpy as np
+from bson.binary import Binary
+from pymongo import ReturnDocument
+from database import mongo
+from config.organizations import ORGANIZATIONS, DEFAULT_ORG, get_org_config
+from services.embedding_stats import record_embeddings_change
+from try_catch_decorator_new import handle_exceptions
+
+ORG_INDEX_SYNC_SECONDS = float(os.getenv('ORG_INDEX_SYNC_SECONDS', '5'))
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer; a waiting writer holds back new readers so it is not starved."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class IndexState:
+    """The in-memory FAISS index, per-user chunk ids and chunk texts of one OrgIndex."""
+
+    def __init__(self, organization):
+        self.organization = organization
+        self.index = None
+        self.user_ids = {}
+        self.texts = {}
+
+    @property
+    def nbytes(self):
+        if self.index is None:
+            return 0
+        return self.index.ntotal * (self.index.d * 4 + 8) + sum(len(text) for text in self.texts.values())
+
+    def add_user(self, username, prepared):
+        """Adds a user's (vectors, ids, texts, model) as returned by prepare_docs."""
+        vectors, ids, texts, model = prepared
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        elif vectors.shape[1] != self.index.d:
+            print(f"Skipping {username} in {self.organization} index: {vectors.shape[1]}-d vectors "
+                  f"from model {model}, index is {self.index.d}-d", flush=True)
+            return
+        self.index.add_with_ids(vectors, ids)
+        self.user_ids[username] = ids
+        self.texts.update(texts)
+
+    def drop_user(self, username):
+        ids = self.user_ids.pop(username, None)
+        if ids is None:
+            return
+        self.index.remove_ids(ids)
+        for chunk_id in ids:
+            self.texts.pop(int(chunk_id), None)
+
+
+def prepare_docs(docs):
+    vectors = np.vstack([np.frombuffer(doc["vector"], dtype="float32") for doc in docs])
+    ids = np.array([doc["_id"] for doc in docs], dtype="int64")
+    return vectors, ids, {doc["_id"]: doc["text"] for doc in docs}, docs[0].get("model")
+
+
+class OrgIndex:
+    """One resident FAISS index holding every user's chunk vectors for an organization.
+
+    Vectors live in the `chunk_vectors` collection; each write bumps a revision and logs the
+    affected username in `index_changes`, so other workers replay only the users that changed.
+    Searches share a read lock. A sync does its Mongo reads without it and takes the write lock
+    only to apply the changes (or swap in a rebuilt index), so reads never wait on the network.
+    """
+
+    def __init__(self, organization):
+        self.organization = organization
+        self.state = IndexState(organization)
+        self.revision = None
+        self.last_sync = 0.0
+        self._rw_lock = ReadWriteLock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def db(self):
+        return mongo.get_db(self.organization)
+
+    @property
+    def nbytes(self):
+        return self.state.nbytes
+
+    def replace_user(self, username, vectors, chunks, model=None):
+        db = self.db
+        removed_users, removed_bytes = self._stored_totals(db, {"username": username})
+        db.chunk_vectors.delete_many({"username": username})
+        added_bytes = 0
+        if chunks:
+            first_id = self._allocate_ids(db, len(chunks))
+            docs = []
+            for position, (vector, chunk) in enumerate(zip(vectors, chunks)):
+                vector_bytes = np.asarray(vector, dtype="float32").tobytes()
+                nbytes = len(vector_bytes) + len(chunk.encode("utf-8"))
+                added_bytes += nbytes
+                docs.append({
+                    "_id": first_id + position,
+                    "username": username,
+                    "position": position,
+                    "text": chunk,
+                    "vector": Binary(vector_bytes),
+                    "nbytes": nbytes,
+                    "model": model
+                })
+            db.chunk_vectors.insert_many(docs)
+        self._record_change(db, username)
+        record_embeddings_change(self.organization, (1 if chunks else 0) - removed_users,
+                                 added_bytes - removed_bytes)
+
+    def remove_user(self, username):
+        db = self.db
+        removed_users, removed_bytes = self._stored_totals(db, {"username": username})
+        db.chunk_vectors.delete_many({"username": username})
+        self._record_change(db, username)
+        record_embeddings_change(self.organization, -removed_users, -removed_bytes)
+
+    def remove_all(self):
+        db = self.db
+        removed_users, removed_bytes = self._stored_totals(db, {})
+        db.chunk_vectors.delete_many({})
+        self._record_change(db, None)
+        record_embeddings_change(self.organization, -removed_users, -removed_bytes)
+
+    def search(self, username, query_embedding, k=3):
+        self.sync()
+        with self._rw_lock.read():
+            state = self.state
+            ids = state.user_ids.get(username)
+            if ids is None or not len(ids):
+                return []
+            query = np.asarray([query_embedding], dtype="float32")
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+            _, found = state.index.search(query, min(k, len(ids)), params=params)
+            return [state.texts[int(i)] for i in found[0] if i != -1]
+
+    def user_version(self, username):
+        """Chunk ids are reallocated on every save, so the first id identifies the user's current vectors."""
+        self.sync()
+        with self._rw_lock.read():
+            ids = self.state.user_ids.get(username)
+            if ids is None or not len(ids):
+                return None
+            return str(int(ids[0]))
+
+    def stats(self):
+        with self._rw_lock.read():
+            state = self.state
+            return {
+                "vectors": state.index.ntotal if state.index is not None else 0,
+                "users": len(state.user_ids),
+                "size_bytes": state.nbytes,
+                "revision": self.revision
+            }
+
+    def _sync_due(self):
+        return time.monotonic() - self.last_sync >= ORG_INDEX_SYNC_SECONDS
+
+    def sync(self, force=False):
+        """Replays changes from other workers. Only one thread syncs at a time; once the index is
+        loaded, the others keep searching the current state instead of waiting for it.
+        """
+        if not force and not self._sync_due():
+            return
+        if not self._sync_lock.acquire(blocking=force or self.revision is None):
+            return
+        try:
+            if not force and not self._sync_due():
+                return
+            db = self.db
+            if self.revision is None:
+                self._load_all(db)
+            else:
+                changes = self._pending_changes(db)
+                if changes is None or any(change["username"] is None for change in changes):
+                    self._load_all(db)
+                elif changes:
+                    self._reload_users(db, {change["username"] for change in changes}, changes[-1]["revision"])
+            self.last_sync = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def _pending_changes(self, db):
+        """Returns the changes after this worker's revision, or None when some have already expired.
+
+        Only the run of consecutive revisions is returned, so a change whose log entry is still
+        being written is picked up by the next sync rather than skipped.
+        """
+        changes = list(db.index_changes.find(
+            {"revision": {"$gt": self.revision}}, {"_id": 0}).sort("revision", 1))
+        if not changes:
+            counter = db.counters.find_one({"_id": "index_revision"})
+            return None if counter and counter["seq"] > self.revision else []
+        if changes[0]["revision"] != self.revision + 1:
+            return None
+        for position, change in enumerate(changes):
+            if change["revision"] != self.revision + 1 + position:
+                return changes[:position]
+        return changes
+
+    def _load_all(self, db):
+        """Builds a fresh state from every stored vector, then swaps it in."""
+        counter = db.counters.find_one({"_id": "index_revision"})
+        revision = counter["seq"] if counter else 0
+        state = IndexState(self.organization)
+        username, docs = None, []
+        for doc in db.chunk_vectors.find({}).sort([("username", 1), ("position", 1)]):
+            if doc["username"] != username and docs:
+                state.add_user(username, prepare_docs(docs))
+                docs = []
+            username = doc["username"]
+            docs.append(doc)
+        if docs:
+            state.add_user(username, prepare_docs(docs))
+        with self._rw_lock.write():
+            self.state = state
+            self.revision = revision
+
+    def _reload_users(self, db, usernames, revision):
+        loaded = {username: list(db.chunk_vectors.find({"username": username}).sort("position", 1))
+                  for username in usernames}
+        with self._rw_lock.write():
+            for username, docs in loaded.items():
+                self.state.drop_user(username)
+                if docs:
+                    self.state.add_user(username, prepare_docs(docs))
+            self.revision = revision
+
+    def _stored_totals(self, db, query):
+        """Returns (users, bytes) currently stored for the matching chunk vectors."""
+        groups = list(db.chunk_vectors.aggregate([
+            {"$match": query},
+            {"$group": {"_id": "$username", "nbytes": {"$sum": "$nbytes"}}}
+        ]))
+        return len(groups), sum(group["nbytes"] for group in groups)
+
+    def _allocate_ids(self, db, count):
+        counter = db.counters.find_one_and_update(
+            {"_id": "chunk_vectors"},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    def _record_change(self, db, username):
+        counter = db.counters.find_one_and_update(
+            {"_id": "index_revision"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        db.index_changes.insert_one({
+            "revision": counter["seq"],
+            "username": username,
+            "created_at": datetime.utcnow()
+        })
+        self.last_sync = 0.0
+
+
+_org_indexes = {}
+_org_indexes_lock = threading.Lock()
+
+
+@handle_exceptions
+def shared_index_enabled(organization=None):
+    return get_org_config(organization).get('shared_index', False)
+
+
+@handle_exceptions
+def get_org_index(organization=None):
+    org_key = organization if organization in ORGANIZATIONS else DEFAULT_ORG
+    with _org_indexes_lock:
+        if org_key not in _org_indexes:
+            _org_indexes[org_key] = OrgIndex(org_key)
+        return _org_indexes[org_key]
+
+
+@handle_exceptions
+def get_org_index_stats():
+    with _org_indexes_lock:
+        indexes = dict(_org_indexes)
+    return {org_name: org_index.stats() for org_name, org_index in indexes.items()}
@@ -0,0 +1,121 @@
+import os
+from langchain_core.messages import HumanMessage, SystemMessage
+from config.organizations import get_org_config
+from services.metrics import metrics, org_label, METRICS_ENABLED
+from services.tokens import count_tokens, CHARS_PER_TOKEN
+from try_catch_decorator_new import handle_exceptions
+
+PROMPT_SUMMARY_TOKENS = int(os.getenv('PROMPT_SUMMARY_TOKENS', '150'))
+
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+metrics.describe("prompt_tokens", "Approximate tokens sent per chat prompt section after budgeting.")
+metrics.describe("prompt_history_messages_dropped", "Chat history messages left out of the prompt to fit the budget.")
+
+
+@handle_exceptions
+def get_prompt_budget(organization=None):
+    return get_org_config(organization)['prompt_budget']
+
+
+@handle_exceptions
+def truncate_to_tokens(text, max_tokens):
+    """Cuts `text` to roughly `max_tokens`, at a word boundary when there is one."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = text[:int(max(0, max_tokens) * CHARS_PER_TOKEN)]
+    space = cut.rfind(' ')
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " ..."
+
+
+@handle_exceptions
+def format_history(messages):
+    """Renders chat messages as the "User: ... / Assistant: ..." lines the prompts expect."""
+    if not messages:
+        return "Empty"
+    lines = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            lines.append(f"Earlier in the conversation: {message.content}")
+        elif isinstance(message, HumanMessage):
+            lines.append(f"User: {message.content}")
+        else:
+            lines.append(f"Assistant: {message.content}")
+    return "\n".join(lines)
+
+
+def _summarize_dropped(messages, max_tokens):
+    """A no-LLM summary of dropped turns: the user's earlier questions, newest first to survive the cut."""
+    questions = [message.content for message in messages if isinstance(message, HumanMessage)]
+    if not questions or max_tokens <= 0:
+        return None
+    kept = []
+    used = count_tokens("the user asked ")
+    for question in reversed(questions):
+        tokens = count_tokens(question) + 1
+        if used + tokens > max_tokens:
+            break
+        kept.append(question)
+        used += tokens
+    if not kept:
+        kept = [truncate_to_tokens(questions[-1], max_tokens - used)]
+    return SystemMessage(content="the user asked " + "; ".join(reversed(kept)))
+
+
+@handle_exceptions
+def trim_history(messages, max_tokens):
+    """Keeps the newest messages that fit `max_tokens`; older ones collapse into a short summary message.
+
+    A trimmed history never starts with an assistant reply, so every kept answer keeps its question.
+    """
+    line_tokens = [count_tokens(message.content) + 2 for message in messages]
+    if sum(line_tokens) <= max_tokens:
+        return list(messages), 0
+
+    summary_budget = min(PROMPT_SUMMARY_TOKENS, max_tokens // 4)
+    remaining = max_tokens - summary_budget
+    start = len(messages)
+    while start > 0 and line_tokens[start - 1] <= remaining:
+        start -= 1
+        remaining -= line_tokens[start]
+    while start < len(messages) and not isinstance(messages[start], HumanMessage):
+        start += 1
+
+    kept = list(messages[start:])
+    summary = _summarize_dropped(messages[:start], summary_budget)
+    return ([summary] if summary else []) + kept, start
+
+
+@handle_exceptions
+def fit_context(chunks, max_tokens):
+    """Keeps the highest-ranked chunks that fit `max_tokens`; the first chunk is truncated if it alone is over."""
+    kept = []
+    used = 0
+    for chunk in chunks or []:
+        tokens = count_tokens(chunk) + 1
+        if used + tokens > max_tokens:
+            if not kept:
+                kept.append(truncate_to_tokens(chunk, max_tokens))
+            break
+        kept.append(chunk)
+        used += tokens
+    return kept
+
+
+@handle_exceptions
+def record_prompt_tokens(prompt, organization, **sections):
+    """Observes the token count of each formatted prompt section; returns the counts."""
+    counts = {section: count_tokens(text) for section, text in sections.items()}
+    if METRICS_ENABLED:
+        for section, tokens in counts.items():
+            metrics.observe("prompt_tokens", tokens, buckets=TOKEN_BUCKETS,
+                            prompt=prompt, section=section, organization=org_label(organization))
+    return counts
+
+
+@handle_exceptions
+def record_dropped_messages(dropped, organization=None):
+    if dropped and METRICS_ENABLED:
+        metrics.increment("prompt_history_messages_dropped", dropped, organization=org_label(organization))
@@ -0,0 +1,98 @@
+import threading
+import faiss
+import numpy as np
+from services.lru_cache import LRUCache
+
+
+def _normalize(embedding):
+    vector = np.asarray([embedding], dtype="float32")
+    faiss.normalize_L2(vector)
+    return vector
+
+
+class UserAnswerCache:
+    """Answers for one user, searchable by cosine similarity of their standalone-question embeddings."""
+
+    def __init__(self, version, max_entries):
+        self.version = version
+        self.max_entries = max_entries
+        self.index = None
+        self.vectors = []
+        self.answers = []
+
+    def lookup(self, vector, threshold):
+        if self.index is None or not self.index.ntotal:
+            return None
+        scores, ids = self.index.search(vector, 1)
+        if ids[0][0] == -1 or scores[0][0] < threshold:
+            return None
+        return self.answers[ids[0][0]]
+
+    def add(self, vector, answer):
+        self.vectors.append(vector[0])
+        self.answers.append(answer)
+        if len(self.answers) > self.max_entries:
+            self.vectors = self.vectors[-self.max_entries:]
+            self.answers = self.answers[-self.max_entries:]
+            self.index = None
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vector.shape[1])
+            self.index.add(np.vstack(self.vectors))
+        else:
+            self.index.add(vector)
+
+
+class ResponseCache:
+    """Per-(org, user) semantic answer cache, valid only while the user's embeddings version is unchanged."""
+
+    def __init__(self, max_users=1000, max_entries_per_user=50, threshold=0.95):
+        self.max_entries_per_user = max_entries_per_user
+        self.threshold = threshold
+        self._users = LRUCache(max_entries=max_users)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def lookup(self, key, version, embedding):
+        vector = _normalize(embedding)
+        with self._lock:
+            user_cache = self._users.get(key)
+            answer = None
+            if user_cache is not None and user_cache.version != version:
+                self._users.pop(key)
+                self.stale += 1
+            elif user_cache is not None:
+                answer = user_cache.lookup(vector, self.threshold)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, key, version, embedding, answer):
+        if version is None or not answer:
+            return
+        vector = _normalize(embedding)
+        with self._lock:
+            user_cache = self._users.get(key)
+            if user_cache is None or user_cache.version != version:
+                user_cache = UserAnswerCache(version, self.max_entries_per_user)
+                self._users.set(key, user_cache)
+            user_cache.add(vector, answer)
+
+    def invalidate_where(self, predicate):
+        return self._users.invalidate_where(predicate)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": self._users.stats()["entries"],
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_invalidations": self.stale,
+                "user_evictions": self._users.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
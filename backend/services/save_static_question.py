@@ -1,9 +1,15 @@
-from services.chatbot_service import get_user_chat_response
+import os
+from concurrent.futures import ThreadPoolExecutor
+from services.chatbot_service import get_initial_state
+from services.agents import create_rag_node
+from services.embedding_service import get_relevant_chunks_batch
 from database import mongo
+from services.metrics import span
 from try_catch_decorator_new import handle_exceptions
-from tenacity import retry, wait_fixed, stop_after_attempt
 from try_catch_decorator_new import CustomException
 
+STATIC_ANSWER_WORKERS = int(os.getenv('STATIC_ANSWER_WORKERS', '3'))
+
 
 @handle_exceptions
 def list_static_questions():
@@ -14,21 +20,35 @@ def list_static_questions():
 
 
 @handle_exceptions
-@retry(wait=wait_fixed(60), stop=stop_after_attempt(2))
-def call_chatbot_service(name, question, organization=None):
-    response, status_code = get_user_chat_response(name, [[question, ""]], organization)
-    return response['response']
+def answer_static_questions(name, questions, organization=None):
+    """Answers already-standalone questions without intent analysis.
+
+    Retrieval for every question shares one index load and one embedding request, and the
+    RAG LLM calls run concurrently, so latency tracks the slowest question.
+    """
+    contexts, query_embeddings, version = get_relevant_chunks_batch(name, questions, organization)
+
+    def answer(question, context, query_embedding):
+        state = get_initial_state(question, [], name, organization)
+        state.update({
+            "context": context,
+            "standalone_question": question,
+            "query_embedding": query_embedding,
+            "embeddings_version": version
+        })
+        return create_rag_node(state)["response"]
+
+    with ThreadPoolExecutor(max_workers=STATIC_ANSWER_WORKERS) as executor:
+        return list(executor.map(answer, questions, contexts, query_embeddings))
 
 
 @handle_exceptions
 def question_answering_on_static_question(name, organization=None):
     questions = list_static_questions()
-    answers = []
-    for question in questions:
-        response = call_chatbot_service(name, question, organization)
-        answers.append(response)
-    mongo.get_db(organization).users.update_one(
-        {"name": name}, {"$set": {"static_answers": answers}})
+    answers = answer_static_questions(name, questions, organization)
+    with span("mongo_write", organization):
+        mongo.get_db(organization).users.update_one(
+            {"name": name}, {"$set": {"static_answers": answers}})
     return answers
 
 
@@ -43,7 +63,7 @@ def list_static_questions_for_frontend(name):
 @handle_exceptions
 def get_question_answer_on_static_question(name, organization=None):
     questions = list_static_questions_for_frontend(name)
-    user_data = mongo.get_db(organization).users.find_one({"name": name})
+    user_data = mongo.get_db(organization).users.find_one({"name": name}, {"_id": 0, "static_answers": 1})
     if not user_data or "static_answers" not in user_data:
         raise CustomException("Static answers not found for this user")
     answers = user_data["static_answers"]
@@ -0,0 +1,11 @@
+import os
+
+# Llama and Jina tokenizers both average about four characters per token on English prose.
+CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', '4'))
+
+
+def count_tokens(text):
+    """Approximate token count of `text`, cheap enough to call on every prompt section."""
+    if not text:
+        return 0
+    return int(-(-len(text) // CHARS_PER_TOKEN))
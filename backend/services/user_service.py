@@ -1,7 +1,23 @@
-from database import mongo
+import base64
+import json
+import os
+import re
+from database import mongo, EMBEDDINGS_FILES_QUERY
 from gridfs import GridFS
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
 from datetime import datetime
 from try_catch_decorator_new import handle_exceptions, CustomException
+from services.embedding_service import invalidate_user_index, invalidate_organization_indexes
+from services.org_index import shared_index_enabled, get_org_index
+from services.embedding_stats import record_embeddings_change
+from services.auth_service import invalidate_user_principals, invalidate_organization_principals
+from services.metrics import span
+
+USERS_PAGE_SIZE = int(os.getenv('USERS_PAGE_SIZE', '100'))
+USERS_MAX_PAGE_SIZE = int(os.getenv('USERS_MAX_PAGE_SIZE', '1000'))
+
 
 @handle_exceptions
 def create_user(name, password, text, organization):
@@ -12,15 +28,16 @@ def create_user(name, password, text, organization):
         raise CustomException("Initial text is required")
 
     db = mongo.get_db(organization)
-    if db.users.find_one({"name": name}):
+    if db.users.find_one({"name": name}, {"_id": 1}):
         raise ValueError("Name already exists")
 
     created_at = datetime.utcnow()
-    db.users.insert_one({
-        "name": name, 
-        "password": password, 
-        "created_at": created_at
-    })
+    with span("mongo_write", organization):
+        db.users.insert_one({
+            "name": name, 
+            "password": password, 
+            "created_at": created_at
+        })
     return name
 
 
@@ -39,55 +56,138 @@ def delete_user_by_name(name, organization):
     embedding_file = fs.find_one({"filename": f"{name}_embeddings"})
     if embedding_file:
         fs.delete(embedding_file._id)
+        record_embeddings_change(organization, -1, -embedding_file.length)
+    invalidate_user_index(name, organization)
+    if shared_index_enabled(organization):
+        get_org_index(organization).remove_user(name)
+    invalidate_user_principals(name, organization)
 
     return {"message": f"User {name} deleted successfully"}, 200
 
 
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise CustomException("Invalid cursor")
+
+
+def page_limit(limit):
+    if limit is None:
+        return USERS_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise CustomException("Limit must be a number")
+    return max(1, min(limit, USERS_MAX_PAGE_SIZE))
+
+
+def name_prefix_query(prefix):
+    """Anchored, case-sensitive prefix match, which MongoDB serves from the users.name index."""
+    return {"name": {"$regex": f"^{re.escape(prefix)}"}} if prefix else {}
+
+
+def _paginate(docs, limit, serialize, cursor_of, page):
+    """Yields up to `limit` serialized docs from a cursor fetched with limit + 1, and stores the
+    next page's cursor (or None) in `page` once the items are consumed."""
+    try:
+        for count, doc in enumerate(docs):
+            if count == limit:
+                page["next_cursor"] = encode_cursor(cursor_of(last))
+                break
+            last = doc
+            yield serialize(doc)
+    finally:
+        docs.close()
+
+
+def _serialize_user(user):
+    return {
+        "name": user["name"],
+        "password": user.get("password"),
+        "created_at": user["created_at"].isoformat() if user.get("created_at") else None,
+        "modifications": user.get("modifications", 0)
+    }
+
+
 @handle_exceptions
-def get_all_users(organization=None):
+def get_all_users(organization=None, cursor=None, limit=None, prefix=None):
+    """Returns (users, page): a lazy page of users, newest first, and a dict holding `next_cursor`.
+
+    Sorting and paging happen in MongoDB on the (created_at, _id) index.
+    """
     db = mongo.get_db(organization)
-    users = list(db.users.find(
-        {},
+    limit = page_limit(limit)
+    query = name_prefix_query(prefix)
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+            created_at, last_id = datetime.fromisoformat(created_at), ObjectId(last_id)
+        except (TypeError, ValueError, InvalidId):
+            raise CustomException("Invalid cursor")
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}}
+        ]
+    docs = db.users.find(
+        query,
         {
-            "_id": 0,
+            "_id": 1,
             "name": 1,
             "password": 1,
             "created_at": 1,
             "modifications": 1
         }
-    ))
-
-    latest_users = sorted(users, key=lambda x: x['created_at'], reverse=True)
+    ).sort([("created_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1)
+    page = {"next_cursor": None}
+    return iter_users_page(docs, limit, page, organization), page
 
-    for user in latest_users:
-        if 'created_at' in user:
-            user['created_at'] = user['created_at'].isoformat()
-        if 'modifications' not in user:
-            user['modifications'] = 0
 
-    return {"users": latest_users}, 200
+@handle_exceptions
+def iter_users_page(docs, limit, page, organization=None):
+    """The lazy half of get_all_users; the query runs, and is timed, as this is iterated."""
+    yield from _paginate(docs, limit, _serialize_user,
+                         lambda user: [user["created_at"].isoformat(), str(user["_id"])], page)
 
 
 @handle_exceptions
-def get_user_names(organization=None):
+def get_user_names(organization=None, cursor=None, limit=None, prefix=None):
+    """Returns (names, page) for users in name order, optionally restricted to a name prefix."""
     db = mongo.get_db(organization)
-    users = list(db.users.find(
-        {},
-        {
-            "_id": 0,
-            "name": 1
-        }
-    ))
-    user_names = [user['name'] for user in users]
-    return {"names": user_names}, 200
+    limit = page_limit(limit)
+    query = name_prefix_query(prefix)
+    if cursor:
+        query = {"$and": [query, {"name": {"$gt": decode_cursor(cursor)}}]}
+    docs = db.users.find(query, {"_id": 0, "name": 1}).sort("name", ASCENDING).limit(limit + 1)
+    page = {"next_cursor": None}
+    return iter_user_names_page(docs, limit, page, organization), page
+
+
+@handle_exceptions
+def iter_user_names_page(docs, limit, page, organization=None):
+    """The lazy half of get_user_names."""
+    yield from _paginate(docs, limit, lambda user: user["name"], lambda user: user["name"], page)
 
 
 @handle_exceptions
 def delete_all_users(organization=None):
     db = mongo.get_db(organization)
     fs = GridFS(db)
-    for grid_file in fs.find({"filename": {"$regex": "_embeddings$"}}):
+    deleted_files = 0
+    deleted_bytes = 0
+    for grid_file in fs.find(EMBEDDINGS_FILES_QUERY):
         fs.delete(grid_file._id)
+        deleted_files += 1
+        deleted_bytes += grid_file.length
+    record_embeddings_change(organization, -deleted_files, -deleted_bytes)
+    invalidate_organization_indexes(organization)
+    if shared_index_enabled(organization):
+        get_org_index(organization).remove_all()
+    invalidate_organization_principals(organization)
 
     result = db.users.delete_many({})
 
@@ -1,6 +1,9 @@
 
+import inspect
+import time
 from functools import wraps
 from flask import jsonify
+from services.metrics import record_call
 
 
 class CustomException(Exception):
@@ -8,14 +11,65 @@ class CustomException(Exception):
     pass
 
 
+def _organization_getter(func):
+    """Returns a function that picks the `organization` argument out of a call, for metric labels."""
+    try:
+        parameters = list(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return lambda args, kwargs: None
+    if "organization" not in parameters:
+        return lambda args, kwargs: None
+    position = parameters.index("organization")
+    return lambda args, kwargs: kwargs.get("organization", args[position] if len(args) > position else None)
+
+
 def handle_exceptions(func):
+    name = func.__qualname__
+    get_organization = _organization_getter(func)
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                print(f"Error in function {func.__name__}", flush=True)
+                raise e
+            finally:
+                record_call(name, time.perf_counter() - started, get_organization(args, kwargs), failed)
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(func):
+        # Generators do their work while being iterated, so time and catch errors until they finish.
+        @wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return (yield from func(*args, **kwargs))
+            except Exception as e:
+                failed = True
+                print(f"Error in function {func.__name__}", flush=True)
+                raise e
+            finally:
+                record_call(name, time.perf_counter() - started, get_organization(args, kwargs), failed)
+        return generator_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        failed = False
         try:
             return func(*args, **kwargs)
         except Exception as e:
+            failed = True
             print(f"Error in function {func.__name__}", flush=True)
             raise e
+        finally:
+            record_call(name, time.perf_counter() - started, get_organization(args, kwargs), failed)
     return wrapper
 
 
@@ -51,7 +51,7 @@ const API = {
         }
       );
       
-      if (response.status === 201) {
+      if (response.status === 201 || response.status === 202) {
         return response.data;
       } else {
         throw new Error(response.data?.error || 'Failed to create user');